@@ -0,0 +1,137 @@
+'''
+    Thread safe least-recently-used cache, shared by fonts, icons etc.
+
+    Loading is single-flight: when several threads ask for the same missing
+    key at once, one of them runs the loader and the others wait for its
+    result. Entries are evicted (least recently used first) when the total
+    size of all entries exceeds the budget. By default every entry has size 1,
+    so the budget is the maximum number of entries.
+'''
+import logging
+from threading import Lock, Event
+from collections import OrderedDict
+
+class _Flight:
+    def __init__(self):
+        self.event = Event()
+        self.value = None
+        self.error = None
+
+class LRUCache:
+    # All caches by name, for reporting statistics
+    instances = {}
+
+    def __init__(self, name, budget = 256, sizeof = None):
+        self.logger = logging.getLogger(__name__)
+
+        self.name = name
+        self.budget = budget
+        self._sizeof = sizeof if sizeof else (lambda value: 1)
+
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._size = 0
+        self._loading = {}
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        LRUCache.instances[name] = self
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, loader):
+        '''
+            Return cached value for key, or load it by calling loader().
+            None values are returned but not cached.
+        '''
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+
+            self.misses += 1
+
+            flight = self._loading.get(key)
+            owner = flight == None
+            if owner:
+                flight = self._loading[key] = _Flight()
+
+        if not owner:
+            # Someone else is loading this key already
+            flight.event.wait()
+            if flight.error:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            flight.value = value
+            self.put(key, value)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            flight.event.set()
+
+        return value
+
+    def peek(self, key):
+        '''
+            Return cached value for key, or None. Doesn't load anything
+        '''
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+
+    def put(self, key, value):
+        if value == None:
+            return
+
+        size = self._sizeof(value)
+
+        with self._lock:
+            if key in self._items:
+                self._size -= self._sizes[key]
+
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self._sizes[key] = size
+            self._size += size
+
+            # Evict least recently used entries, but keep the newest one
+            while self._size > self.budget and len(self._items) > 1:
+                old_key, _ = self._items.popitem(last = False)
+                self._size -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._items),
+            'size': self._size,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
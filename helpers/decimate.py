@@ -0,0 +1,121 @@
+'''
+    Reduce long series to about two points per pixel column before plotting
+
+    Only needs NumPy, so series can be reduced in the main process before
+    they are sent to the plot worker (plotworker.py).
+'''
+import numpy as np
+
+def minmax(y, buckets):
+    '''
+        Indices of the minimum and maximum of y in each of (about)
+        `buckets` equal parts, plus the first and last point, in order
+    '''
+    n = len(y)
+    if n <= 2 * buckets + 2:
+        return np.arange(n)
+
+    k = n // buckets
+    m = n // k
+
+    # View of all full buckets as rows
+    rows = y[:m * k].reshape(m, k)
+    offsets = np.arange(m) * k
+    lo = rows.argmin(axis = 1) + offsets
+    hi = rows.argmax(axis = 1) + offsets
+
+    idx = [[0], np.column_stack([lo, hi]).ravel(), [n - 1]]
+
+    if m * k < n:
+        tail = y[m * k:]
+        idx.insert(2, [tail.argmin() + m * k, tail.argmax() + m * k])
+
+    return np.unique(np.concatenate(idx))
+
+def lttb(x, y, points):
+    '''
+        Indices of `points` points chosen with Largest-Triangle-Three-
+        Buckets, which keeps the visual shape of the line
+    '''
+    n = len(y)
+    if n <= points or points < 3:
+        return np.arange(n)
+
+    # Do arithmetic on dates as integers
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.view('int64')
+
+    # Bucket edges, first and last point have their own bucket
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+
+    idx = np.empty(points, dtype = int)
+    idx[0] = 0
+    idx[-1] = n - 1
+
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+
+        # Average of the next bucket (or the last point)
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        x_avg = np.mean(x[hi:next_hi], dtype = float)
+        y_avg = np.mean(y[hi:next_hi], dtype = float)
+
+        x_a = float(x[a])
+        y_a = float(y[a])
+
+        # Point in this bucket making the largest triangle with the
+        # previous choice and the average of the next bucket
+        area = np.abs(
+            (x_a - x_avg) * (y[lo:hi] - y_a)
+            - (x_a - x[lo:hi].astype(float)) * (y_avg - y_a)
+        )
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+
+    return idx
+
+def decimate(x_data, y_data, width, method = 'minmax', start = 0):
+    '''
+        Reduce a long series to about two points per pixel column of
+        `width`, using min/max per column ('minmax') or
+        Largest-Triangle-Three-Buckets ('lttb'). With method None, or a
+        series that is short already, every point is kept.
+        Works on views of NumPy arrays, so ring buffers can be given as
+        is with `start` the index of the oldest point. The result is in
+        order, oldest point first.
+    '''
+    x_data = np.asarray(x_data)
+    y_data = np.asarray(y_data)
+    n = len(y_data)
+
+    if start:
+        # Oldest part first, both are views
+        parts = [(x_data[start:], y_data[start:]),
+            (x_data[:start], y_data[:start])]
+    else:
+        parts = [(x_data, y_data)]
+
+    if n <= 2 * width or not method:
+        if len(parts) == 1:
+            return x_data, y_data
+        return (np.concatenate([x for x, _ in parts]),
+            np.concatenate([y for _, y in parts]))
+
+    xs = []
+    ys = []
+    for x, y in parts:
+        # Share of the pixel columns for this part
+        buckets = max(1, round(width * len(y) / n))
+
+        if method == 'minmax':
+            idx = minmax(y, buckets)
+        elif method == 'lttb':
+            idx = lttb(x, y, 2 * buckets)
+        else:
+            raise ValueError('Unknown decimation method {}'.format(method))
+
+        xs.append(x[idx])
+        ys.append(y[idx])
+
+    return np.concatenate(xs), np.concatenate(ys)
@@ -0,0 +1,240 @@
+'''
+    Display list for widgets: record text, icon and line operations while
+    laying out a frame, then draw them onto the canvas in one batch
+
+    All ops share one ImageDraw object and fonts/icons are looked up once per
+    batch. When the list is (partly) identical to the previous frame, only the
+    regions around changed ops are cleared and redrawn.
+
+    A widget using this should draw everything on its canvas through the list
+    and not clear the canvas itself, e.g.
+
+        self.ops = DrawList(cfg, self.canvas)
+        ...
+        self.ops.write('Hello', pos = (10, 10), font = self.font, fontsize = 20)
+        self.ops.icon('regular/calendar', 18, pos = (10, 40))
+        self.ops.render()
+'''
+import logging
+from PIL import ImageDraw
+from helpers.textfun import Text
+from helpers.fontawesome import FontAwesome
+
+class DrawList:
+
+    def __init__(self, cfg, canvas, background = 0xFF):
+        self.logger = logging.getLogger(__name__)
+
+        self.canvas = canvas
+        self.background = background
+
+        self._text = Text(cfg)
+        self._fa = FontAwesome(cfg)
+
+        self._ops = []
+        # Ops drawn in the previous frame, None forces a full redraw
+        self._prev = None
+
+    def clear(self):
+        '''
+            Throw away recorded ops, e.g. when a frame was not finished
+        '''
+        self._ops = []
+
+    def invalidate(self):
+        '''
+            Redraw everything on the next render, e.g. after the canvas
+            was modified outside of the display list
+        '''
+        self._prev = None
+
+    def write(self, text, pos = (0,0), font = None, fontsize = None,
+        fill = None, anchor = 'la', max_width = 0):
+        '''
+            Same as Text.write, without the buffer argument
+        '''
+        self._ops.append(('text', str(text), tuple(pos), font, fontsize,
+            fill, anchor, max_width))
+
+    def textbox(self, text, width, pos = (0,0), max_lines = None,
+        font = None, fontsize = None, fill = None, spacing = 0, **kwargs):
+        '''
+            Same as Text.textbox, without the buffer argument.
+            Line breaks are determined right away, as the returned
+            (width, height) is usually needed for the layout
+        '''
+        if fontsize == None:
+            raise ValueError("Font size needs to be specified!")
+
+        lines = self._text._split_lines(self.canvas, text, width, pos,
+            max_lines, font, fontsize, **kwargs)
+
+        hh = pos[1]
+
+        for line in lines:
+            if not line:
+                continue
+            self.write(line,
+                pos = (pos[0], hh),
+                font = font,
+                fontsize = fontsize,
+                fill = fill,
+                **kwargs
+            )
+            hh += (fontsize + spacing)
+
+        hh = max(hh, fontsize)
+
+        return (width, hh - pos[1])
+
+    def icon(self, name, size = None, pos = (0,0), angle = 0):
+        '''
+            Same as FontAwesome.paste_icon, optionally rotated
+            clockwise by angle (degrees)
+        '''
+        self._ops.append(('icon', name, size, tuple(pos), angle))
+
+    def line(self, xy, fill = None, width = 0):
+        self._ops.append(('line', tuple(xy), fill, width))
+
+    def rectangle(self, xy, fill = None):
+        self._ops.append(('rectangle', tuple(xy), fill))
+
+    def render(self):
+        '''
+            Draw recorded ops onto the canvas and start a new list.
+            Returns the number of ops that were (re)drawn.
+        '''
+        ops, prev = self._ops, self._prev
+        self._ops = []
+        self._prev = ops
+
+        if ops == prev:
+            return 0
+
+        draw = ImageDraw.Draw(self.canvas)
+
+        # Resolve fonts and icons once for this batch
+        fonts = {}
+        icons = {}
+
+        def get_font(font, fontsize):
+            key = (font, fontsize)
+            if key not in fonts:
+                fonts[key] = self._text._get_font(font, fontsize)
+            return fonts[key]
+
+        def get_icon(name, size, angle):
+            key = (name, size, angle)
+            if key not in icons:
+                icons[key] = self._fa.get_rotated_icon(name, size, angle)
+            return icons[key]
+
+        def text_line(op):
+            _, text, pos, font, fontsize, fill, anchor, max_width = op
+            dFont = get_font(font, fontsize)
+            if max_width:
+                bbox = draw.textbbox((0,0), text, dFont)
+                if abs(bbox[2] - bbox[0]) > max_width:
+                    text = self._text._truncate(draw, dFont, text, max_width)
+            return text, dFont
+
+        def bbox(op):
+            kind = op[0]
+            if kind == 'text':
+                text, dFont = text_line(op)
+                box = draw.textbbox(op[2], text, dFont, anchor=op[6])
+            elif kind == 'icon':
+                _, name, size, pos, angle = op
+                icon = get_icon(name, size, angle)
+                if not icon:
+                    return None
+                box = (pos[0], pos[1],
+                    pos[0] + icon.width, pos[1] + icon.height)
+            elif kind == 'line':
+                _, xy, fill, width = op
+                if not xy:
+                    return None
+                if isinstance(xy[0], (tuple, list)):
+                    xs = [p[0] for p in xy]
+                    ys = [p[1] for p in xy]
+                else:
+                    xs = xy[0::2]
+                    ys = xy[1::2]
+                w = width // 2 + 1
+                box = (min(xs) - w, min(ys) - w, max(xs) + w, max(ys) + w)
+            else:
+                _, xy, fill = op
+                if isinstance(xy[0], (tuple, list)):
+                    xy = (*xy[0], *xy[1])
+                box = xy
+            # Grow by a pixel for anti-aliasing
+            return (box[0] - 1, box[1] - 1, box[2] + 1, box[3] + 1)
+
+        def paint(op):
+            kind = op[0]
+            if kind == 'text':
+                text, dFont = text_line(op)
+                draw.text(op[2], text, font=dFont, fill=op[5], anchor=op[6])
+            elif kind == 'icon':
+                _, name, size, pos, angle = op
+                icon = get_icon(name, size, angle)
+                if icon:
+                    self.canvas.paste(icon, (pos[0], pos[1],
+                        pos[0] + icon.width, pos[1] + icon.height))
+            elif kind == 'line':
+                _, xy, fill, width = op
+                draw.line(xy, fill=fill, width=width)
+            else:
+                _, xy, fill = op
+                draw.rectangle(xy, fill=fill)
+
+        if prev == None:
+            self.canvas.paste(self.background,
+                box=(0, 0, self.canvas.width, self.canvas.height))
+            for op in ops:
+                paint(op)
+            return len(ops)
+
+        # Regions of ops that were removed or added since the last frame
+        prev_set = set(prev)
+        ops_set = set(ops)
+        dirty = [bbox(op) for op in prev if op not in ops_set]
+        dirty += [bbox(op) for op in ops if op not in prev_set]
+        dirty = [box for box in dirty if box]
+
+        if not dirty:
+            # Same ops in a different order, start over
+            self._prev = None
+            self._ops = ops
+            return self.render()
+
+        # Ops overlapping a dirty region need redrawing, which in turn
+        # dirties everything they cover
+        boxes = [bbox(op) for op in ops]
+        redraw = [False] * len(ops)
+        changed = True
+        while changed:
+            changed = False
+            for i, box in enumerate(boxes):
+                if redraw[i] or not box:
+                    continue
+                if any(self._overlap(box, d) for d in dirty):
+                    redraw[i] = True
+                    dirty.append(box)
+                    changed = True
+
+        for box in dirty:
+            draw.rectangle(box, fill=self.background)
+
+        for i, op in enumerate(ops):
+            if redraw[i]:
+                paint(op)
+
+        self.logger.debug('Redrew {} of {} ops'.format(sum(redraw), len(ops)))
+
+        return sum(redraw)
+
+    @staticmethod
+    def _overlap(a, b):
+        return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
@@ -0,0 +1,86 @@
+'''
+    Calendar items by local date
+
+    Every event is stored as one item per day it covers, kept sorted within
+    the day, together with the end of the event. Adding, changing or removing
+    an event only touches the days of that event, and a range of days is
+    found by bisecting the sorted dates. Events that are over are left out
+    when reading, and dropped from the index a day later.
+    The index can be pickled as is, to keep it between runs.
+'''
+from bisect import bisect_left, bisect_right, insort
+
+class EventIndex:
+
+    def __init__(self):
+        # Sorted (key, id, end, item) per date
+        self.days = {}
+        # Sorted dates that have items
+        self.dates = []
+        # Dates per event id
+        self.events = {}
+
+    def __len__(self):
+        return len(self.events)
+
+    def put(self, id, entries):
+        '''
+            Add or replace event id, entries: list of
+            (date, sort key, end, item)
+        '''
+        self.remove(id)
+
+        for day, key, end, item in entries:
+            if day not in self.days:
+                insort(self.dates, day)
+                self.days[day] = []
+            insort(self.days[day], (key, id, end, item))
+
+        self.events[id] = [entry[0] for entry in entries]
+
+    def remove(self, id):
+        for day in self.events.pop(id, []):
+            if day not in self.days:
+                continue
+
+            bucket = [entry for entry in self.days[day] if entry[1] != id]
+            if bucket:
+                self.days[day] = bucket
+            else:
+                del self.days[day]
+                del self.dates[bisect_left(self.dates, day)]
+
+    def ids(self):
+        return list(self.events)
+
+    def range(self, first, last, after = None):
+        '''
+            Items by date, for dates from first up to and including last.
+            With after, only items of events that end after it
+        '''
+        i = bisect_left(self.dates, first)
+        j = bisect_right(self.dates, last)
+
+        days = {}
+        for day in self.dates[i:j]:
+            items = [entry[3] for entry in self.days[day]
+                if after == None or entry[2] > after]
+            if items:
+                days[day] = items
+
+        return days
+
+    def prune(self, before):
+        '''
+            Forget dates before the given date, and events that are over
+        '''
+        i = bisect_left(self.dates, before)
+        if i == 0:
+            return
+
+        for day in self.dates[:i]:
+            del self.days[day]
+        del self.dates[:i]
+
+        self.events = {id: days for id, days in self.events.items()
+            if days and days[-1] >= before}
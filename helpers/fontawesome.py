@@ -2,45 +2,193 @@
     Use FontAwesome svg's, internally converted to raster images using cairosvg
     Operates similar to textfun.py, keeping previously used icons at specific size in memory
 
+    Rasterized icons are also kept on disk (as raw 8-bit greyscale data), so
+    cairosvg is not needed again after a restart. The cache directory and its
+    size limit are set with 'iconCache' and 'iconCacheSize' (kB) in [main],
+    the memory used by icons is limited by 'iconMemory' (kB).
+
     Check 'README.md' in the 'fa' folder on how to download and extract icons
 
     Icon list at https://fontawesome.com/v5.15/icons?d=gallery&p=2&s=brands,regular,solid&m=free
 '''
+import os
+import struct
 import logging
-from threading import Lock
+import multiprocessing as mp
+from hashlib import sha1
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from io import BytesIO
 from cairosvg import svg2png
 from PIL import Image
+from helpers.cache import LRUCache
 
 logging.getLogger('PIL.PngImagePlugin').setLevel(logging.WARNING)
 
 class FontAwesome:
-    _icons = {}
-    _lock = Lock()
+    # Icons in memory, per (icon, size, angle), limited by number of pixels
+    _icons = LRUCache('icons', sizeof = lambda canvas: canvas.width * canvas.height)
+
+    # Header of cached icon files: width, height
+    _header = struct.Struct('<HH')
 
     def __init__(self, cfg):
         self.logger = logging.getLogger(__name__)
         self._default_size = 18
 
+        FontAwesome._icons.budget = 1024 * int(cfg.get('main', 'iconMemory',
+            fallback = 2048))
+
+        self._cache_dir = cfg.get('main', 'iconCache', fallback = 'cache/icons')
+        self._cache_size = 1024 * int(cfg.get('main', 'iconCacheSize',
+            fallback = 4096))
+
     def get_icon(self, icon, size = None):
         if size == None:
             size = self._default_size
 
-        # Return previously used icons from memory
-        if icon in FontAwesome._icons:
-            if size in FontAwesome._icons[icon]:
-                return FontAwesome._icons[icon][size]
+        # Previously used icons come from memory, concurrent requests for
+        # the same new icon wait for a single load
+        return FontAwesome._icons.get((icon, size, 0),
+            lambda: self._load_icon(icon, size))
 
-        # Load new icon
+    def _load_icon(self, icon, size):
         path = 'fa/{}.svg'.format(icon)
+        key = self._cache_key(path, size)
+        if key == None:
+            self.logger.error('Could not load icon: {}'.format(icon))
+            return None
+
+        canvas = self._load_cached(key)
+
+        if canvas == None:
+            canvas = self._rasterize(path, size)
+            if canvas == None:
+                self.logger.error('Could not load icon: {}'.format(icon))
+                return None
+
+            self._check_size(canvas, size)
+            self._save_cached(key, canvas)
+
+        self.logger.debug('Loaded icon {} size {}'.format(icon, size))
+
+        return canvas
+
+    def get_rotated_icon(self, icon, size = None, angle = 0):
+        '''
+            Icon rotated clockwise by angle (degrees), keeping its size
+        '''
+        if size == None:
+            size = self._default_size
+
+        if not angle:
+            return self.get_icon(icon, size)
+
+        def rotate():
+            canvas = self.get_icon(icon, size)
+            if canvas == None:
+                return None
+
+            return canvas.rotate(
+                angle = -angle, # argument is counter-clockwise
+                fillcolor = 255
+            )
+
+        return FontAwesome._icons.get((icon, size, angle), rotate)
+
+    def preload(self, icons):
+        '''
+            Rasterize a list of (icon, size) pairs ahead of time,
+            spread over all CPU cores
+        '''
+        todo = []
+
+        for icon, size in set(icons):
+            if (icon, size, 0) in FontAwesome._icons:
+                continue
+
+            path = 'fa/{}.svg'.format(icon)
+            key = self._cache_key(path, size)
+            if key == None:
+                self.logger.warning('Could not find icon: {}'.format(icon))
+                continue
+
+            canvas = self._load_cached(key)
+            if canvas != None:
+                FontAwesome._icons.put((icon, size, 0), canvas)
+            else:
+                todo.append((icon, size, path, key))
+
+        if not todo:
+            return
+
+        workers = os.cpu_count() or 1
+        self.logger.debug('Rasterizing {} icons using {} processes'.format(
+            len(todo), workers))
+
+        if workers == 1:
+            # Not worth starting another process
+            for icon, size, path, key in todo:
+                self.get_icon(icon, size)
+            return
+
+        # Widgets may have started threads already, which don't mix
+        # with fork (see plotworker.py)
+        with ProcessPoolExecutor(max_workers = workers,
+            mp_context = mp.get_context('spawn')) as executor:
+            futures = {
+                executor.submit(FontAwesome._rasterize, path, size):
+                    (icon, size, key)
+                for icon, size, path, key in todo
+            }
+
+            for future in as_completed(futures):
+                icon, size, key = futures[future]
+                try:
+                    canvas = future.result()
+                except Exception as e:
+                    self.logger.warning('Could not rasterize icon {}: {}'.format(
+                        icon, e))
+                    continue
+
+                if canvas == None:
+                    continue
+
+                self._check_size(canvas, size)
+                self._save_cached(key, canvas)
+                FontAwesome._icons.put((icon, size, 0), canvas)
+
+    def _check_size(self, canvas, size):
+        if canvas.width != size or canvas.height != size:
+            self.logger.warning("Unexpected canvas size ({}, {})".format(
+                canvas.width, canvas.height
+            ))
+
+    @staticmethod
+    def _cache_key(path, size):
+        '''
+            Key for the on-disk cache, only valid for this exact version of
+            the svg. Returns None if the svg does not exist.
+        '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return sha1('{}:{}:{}:{}'.format(
+            path, size, stat.st_mtime_ns, stat.st_size).encode()).hexdigest()
+
+    @staticmethod
+    def _rasterize(path, size):
+        '''
+            Convert svg to 8-bit greyscale image of size x size pixels
+        '''
         try:
             f = open(path, 'rb')
         except IOError:
-            self.logger.error('Could not load icon: {}'.format(icon))
             return None
 
         with f:
-            output = svg2png(file_obj=f, 
+            output = svg2png(file_obj=f,
                 parent_width = size,
                 parent_height = size
             )
@@ -51,23 +199,76 @@ class FontAwesome:
         canvas = Image.new("RGBA", icon_png.size, "WHITE")
         canvas.alpha_composite(icon_png)
 
-        canvas = canvas.convert('L')
+        return canvas.convert('L')
 
-        if canvas.width != size or canvas.height != size:
-            self.logger.warning("Unexpected canvas size ({}, {})".format(
-                canvas.width, canvas.height
-            ))
+    def _load_cached(self, key):
+        if self._cache_size <= 0:
+            # Disabled, leave files of earlier runs alone
+            return None
 
-        # Add new icon to memory
-        with FontAwesome._lock:
-            if icon not in FontAwesome._icons:
-                FontAwesome._icons[icon] = {}
-            FontAwesome._icons[icon][size] = canvas
+        path = os.path.join(self._cache_dir, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
 
-        self.logger.debug('Loaded icon {} size {}'.format(icon, size))
+        try:
+            width, height = self._header.unpack_from(data)
+            canvas = Image.frombytes('L', (width, height),
+                data[self._header.size:])
+        except (struct.error, ValueError):
+            self.logger.warning('Invalid cached icon {}'.format(path))
+            return None
+
+        # Mark as recently used, used for pruning the cache
+        try:
+            os.utime(path)
+        except OSError:
+            pass
 
         return canvas
 
+    def _save_cached(self, key, canvas):
+        if self._cache_size <= 0:
+            return
+
+        path = os.path.join(self._cache_dir, key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self._cache_dir, exist_ok = True)
+            with open(tmp_path, 'wb') as f:
+                f.write(self._header.pack(canvas.width, canvas.height))
+                f.write(canvas.tobytes())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.logger.warning('Could not cache icon: {}'.format(e))
+            return
+
+        self._prune_cache()
+
+    def _prune_cache(self):
+        '''
+            Remove least recently used icons until the cache fits its limit
+        '''
+        try:
+            entries = [e for e in os.scandir(self._cache_dir) if e.is_file()]
+        except OSError:
+            return
+
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path)
+            for e in entries]
+        total = sum(e[1] for e in entries)
+
+        for mtime, size, path in sorted(entries):
+            if total <= self._cache_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
     def paste_icon(self, canvas, name, size = None, pos = (0,0)):
 
         icon = self.get_icon(name, size)
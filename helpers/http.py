@@ -0,0 +1,311 @@
+'''
+    Shared HTTP client for widgets and data providers
+
+    All requests go through one `requests` session, so connections to a host
+    are kept alive and reused instead of doing a new TCP and TLS handshake
+    for every fetch. Responses are compressed (gzip/deflate, and brotli if
+    the 'brotli' pip package is installed).
+
+    Timeout, retries and the number of simultaneous connections per host
+    are the same for every provider, set with 'httpTimeout' (seconds),
+    'httpRetries' and 'httpHostConnections' in [main].
+
+    Responses of `get(..., cache = True)` are kept in memory and reused
+    while fresh according to Cache-Control/Expires. After that they are
+    revalidated with If-None-Match/If-Modified-Since, and a 304 response
+    gives back the kept body. The `unchanged` attribute of the response
+    tells whether the body is the same as the previous fetch of that URL,
+    so parsing and drawing can be skipped.
+
+    Each host has a circuit breaker: after 'httpBreakerFailures' failed
+    requests in a row (connection errors, timeouts, server errors) requests
+    to it fail right away with `CircuitOpen`, instead of waiting for the
+    timeout. After a back-off ('httpBreakerBackoff' seconds, doubled on
+    every failed try up to 'httpBreakerMaxBackoff', with jitter) a single
+    request is let through to see whether the host is back.
+'''
+import copy
+import time
+import random
+import logging
+from threading import Lock, BoundedSemaphore
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+from helpers.cache import LRUCache
+
+logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    '''
+        Request not sent, the host failed too often recently
+    '''
+
+class HTTP:
+    _lock = Lock()
+    # Shared by all instances
+    _session = None
+    # Limits simultaneous requests, per host
+    _hosts = {}
+    # Circuit breaker state, per host
+    _breakers = {}
+    # Cached responses per URL, limited by size of the bodies
+    _responses = LRUCache('http responses', budget = 4 * 1024 * 1024,
+        sizeof = lambda entry: len(entry['response'].content))
+
+    def __init__(self, cfg):
+        self.logger = logging.getLogger(__name__)
+
+        self.timeout = float(cfg.get('main', 'httpTimeout', fallback = 10))
+        self.retries = int(cfg.get('main', 'httpRetries', fallback = 1))
+        self.hostConnections = int(cfg.get('main', 'httpHostConnections',
+            fallback = 2))
+        self.breakerFailures = int(cfg.get('main', 'httpBreakerFailures',
+            fallback = 3))
+        self.breakerBackoff = float(cfg.get('main', 'httpBreakerBackoff',
+            fallback = 60))
+        self.breakerMaxBackoff = float(cfg.get('main', 'httpBreakerMaxBackoff',
+            fallback = 1800))
+
+    def _get_session(self):
+        with HTTP._lock:
+            if HTTP._session != None:
+                return HTTP._session
+
+            # Retry failed connections and server errors, with a short
+            # back-off. After the last try the response is returned as is
+            retry = Retry(
+                total = self.retries,
+                backoff_factor = 0.5,
+                status_forcelist = (500, 502, 503, 504),
+                allowed_methods = frozenset(['GET', 'HEAD']),
+                raise_on_status = False
+            )
+            adapter = HTTPAdapter(
+                pool_connections = 8,
+                pool_maxsize = self.hostConnections,
+                max_retries = retry
+            )
+
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(make_headers(
+                keep_alive = True,
+                accept_encoding = True
+            ))
+
+            HTTP._session = session
+
+            return session
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+
+        with HTTP._lock:
+            if host not in HTTP._hosts:
+                HTTP._hosts[host] = BoundedSemaphore(self.hostConnections)
+            return HTTP._hosts[host]
+
+    def _breaker(self, host):
+        if host not in HTTP._breakers:
+            HTTP._breakers[host] = {
+                'state': 'closed',
+                'failures': 0,
+                'retryAt': 0,
+                'backoff': 0,
+                'opened': 0,
+                'rejected': 0
+            }
+        return HTTP._breakers[host]
+
+    def _allow(self, host):
+        '''
+            Whether a request to host may be sent, raises CircuitOpen if not
+        '''
+        with HTTP._lock:
+            breaker = self._breaker(host)
+
+            if breaker['state'] == 'closed':
+                return
+
+            if breaker['state'] == 'open' and time.time() >= breaker['retryAt']:
+                # Let one request through to probe the host
+                breaker['state'] = 'half-open'
+                self.logger.info('Probing {}'.format(host))
+                return
+
+            breaker['rejected'] += 1
+            wait = max(0, breaker['retryAt'] - time.time())
+
+        raise CircuitOpen('{} is failing, not trying again for {:.0f} s'.format(
+            host, wait))
+
+    def _record(self, host, success):
+        with HTTP._lock:
+            breaker = self._breaker(host)
+
+            if success:
+                if breaker['state'] != 'closed':
+                    self.logger.info('{} is back'.format(host))
+                breaker['state'] = 'closed'
+                breaker['failures'] = 0
+                breaker['backoff'] = 0
+                return
+
+            breaker['failures'] += 1
+
+            if (breaker['state'] == 'half-open'
+                or breaker['failures'] >= self.breakerFailures):
+                # Double the wait after every failed probe, with jitter so
+                # not everything tries again at the same moment
+                backoff = min(self.breakerMaxBackoff,
+                    2 * breaker['backoff'] or self.breakerBackoff)
+                breaker['backoff'] = backoff
+                breaker['retryAt'] = time.time() + random.uniform(
+                    backoff / 2, backoff)
+                if breaker['state'] != 'open':
+                    breaker['opened'] += 1
+                breaker['state'] = 'open'
+                self.logger.warning(
+                    '{} failed {} times, not trying again for {:.0f} s'.format(
+                    host, breaker['failures'], breaker['retryAt'] - time.time()))
+
+    def _send(self, session, url, params, headers):
+        '''
+            Do request, through the host's circuit breaker
+        '''
+        host = urlsplit(url).netloc
+
+        self._allow(host)
+
+        try:
+            with self._host_slot(url):
+                r = session.get(url,
+                    params = params,
+                    headers = headers,
+                    timeout = self.timeout
+                )
+        except (requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout):
+            self._record(host, False)
+            raise
+        except Exception:
+            # Not the host's fault, a next request may probe it again
+            with HTTP._lock:
+                breaker = self._breaker(host)
+                if breaker['state'] == 'half-open':
+                    breaker['state'] = 'open'
+            raise
+
+        self._record(host, r.status_code < 500)
+
+        return r
+
+    @classmethod
+    def stats(cls):
+        '''
+            Circuit breaker state per host
+        '''
+        with cls._lock:
+            return {host: dict(breaker)
+                for host, breaker in cls._breakers.items()}
+
+    @staticmethod
+    def _expires(r):
+        '''
+            Time until which response r may be used without asking the
+            server again, None if it should not be kept at all
+        '''
+        now = time.time()
+
+        directives = {}
+        for directive in r.headers.get('Cache-Control', '').lower().split(','):
+            name, _, value = directive.partition('=')
+            directives[name.strip()] = value.strip().strip('"')
+
+        if 'no-store' in directives:
+            return None
+
+        if 'no-cache' in directives:
+            return now
+
+        try:
+            if 'max-age' in directives:
+                age = int(r.headers.get('Age', 0))
+                return now + int(directives['max-age']) - age
+
+            if 'Expires' in r.headers:
+                expires = parsedate_to_datetime(r.headers['Expires']).timestamp()
+                # Correct for clock difference with the server
+                if 'Date' in r.headers:
+                    expires += now - parsedate_to_datetime(
+                        r.headers['Date']).timestamp()
+                return expires
+        except (ValueError, TypeError):
+            pass
+
+        # No freshness information, revalidate every time
+        return now
+
+    def get(self, url, params = None, headers = None, cache = False):
+        '''
+            Same as requests.get, raises the same exceptions.
+            With cache = True, see top of file.
+        '''
+        session = self._get_session()
+
+        if not cache:
+            r = self._send(session, url, params, headers)
+            r.unchanged = False
+            return r
+
+        key = requests.Request('GET', url, params = params).prepare().url
+        entry = HTTP._responses.peek(key)
+
+        if entry != None and time.time() < entry['expires']:
+            self.logger.debug('Using cached response for {}'.format(url))
+            r = copy.copy(entry['response'])
+            r.unchanged = True
+            return r
+
+        headers = dict(headers) if headers else {}
+        if entry != None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['modified']:
+                headers['If-Modified-Since'] = entry['modified']
+
+        r = self._send(session, url, params, headers)
+
+        if r.status_code == 304 and entry != None:
+            self.logger.debug('Response for {} not modified'.format(url))
+            # Entries are shared between threads, so replace rather than
+            # change it
+            expires = self._expires(r)
+            entry = dict(entry,
+                expires = expires if expires != None else entry['expires'],
+                etag = r.headers.get('ETag', entry['etag']))
+            HTTP._responses.put(key, entry)
+
+            r = copy.copy(entry['response'])
+            r.unchanged = True
+            return r
+
+        r.unchanged = (entry != None and r.status_code == 200
+            and r.content == entry['response'].content)
+
+        if r.status_code == 200:
+            expires = self._expires(r)
+            if expires != None:
+                HTTP._responses.put(key, {
+                    'response': r,
+                    'expires': expires,
+                    'etag': r.headers.get('ETag'),
+                    'modified': r.headers.get('Last-Modified')
+                })
+
+        return r
@@ -0,0 +1,35 @@
+'''
+    ISO 8601 timestamps from the data providers
+
+    Parsed with `datetime.fromisoformat`, falling back to dateutil for forms
+    it doesn't know. Providers send the same timestamps again and again
+    (e.g. every refresh of a departure list), so results are remembered,
+    including their conversion to the system timezone.
+'''
+from functools import lru_cache
+from datetime import datetime
+
+@lru_cache(maxsize = 4096)
+def parse(text):
+    '''
+        datetime of an ISO 8601 string
+    '''
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        from dateutil.parser import isoparse
+        return isoparse(text)
+
+@lru_cache(maxsize = 4096)
+def local(text, naive = False):
+    '''
+        datetime of an ISO 8601 string in the system timezone, without
+        timezone attribute if naive. Times without timezone are taken
+        to be local already
+    '''
+    dt = parse(text).astimezone()
+
+    if naive:
+        return dt.replace(tzinfo = None)
+
+    return dt
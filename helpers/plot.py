@@ -3,10 +3,14 @@
 
     Matplotlib is not thread safe, so locks are used here to prevent different
     widgets from accessing this class at the same time
+
+    Figures are kept between calls, per plot type, size, font and labels.
+    A redraw only updates the data of the existing artists, and the layout
+    computed for the first drawing is reused.
 '''
 import logging
 from threading import Lock
-from io import BytesIO
+from functools import lru_cache
 
 import numpy as np
 logging.getLogger('matplotlib').setLevel(logging.WARNING)
@@ -15,16 +19,22 @@ mpl.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import matplotlib.patheffects as path_effects
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from scipy.interpolate import make_interp_spline, BSpline
 
 from datetime import datetime
 
 from PIL import Image
-logging.getLogger('PIL.PngImagePlugin').setLevel(logging.WARNING)
+from helpers.cache import LRUCache
+from helpers.decimate import decimate
 
 class Plot:
     _lock = Lock()
 
+    # Figures and their artists, per plot type, size, font and labels
+    _figures = LRUCache('plot figures', budget = 8)
+
     def __init__(self, cfg):
         self.logger = logging.getLogger(__name__)
 
@@ -38,17 +48,198 @@ class Plot:
         plt.style.use('grayscale')
 
     def _fig_to_img(self, fig):
-        buf = BytesIO()
-        fig.savefig(buf)
-        buf.seek(0)
-        return Image.open(buf)
+        '''
+            Render figure with Agg and wrap its RGBA buffer, no PNG
+            encoding/decoding in between. Converting to 8-bit greyscale
+            copies the pixels, so the buffer can be reused by the next drawing
+        '''
+        fig.canvas.draw()
+        buf = fig.canvas.buffer_rgba()
+        img = Image.frombuffer('RGBA', (buf.shape[1], buf.shape[0]), buf,
+            'raw', 'RGBA', 0, 1)
+        return img.convert('L')
+
+    @staticmethod
+    def _rc(font, fontsize):
+        '''
+            Figure parameters, applied while creating and drawing a figure
+        '''
+        COLOR = 'k'
+        rc = {
+            'font.size': fontsize,
+            'text.color': COLOR,
+            'axes.labelcolor': COLOR,
+            'xtick.color': COLOR,
+            'ytick.color': COLOR
+        }
+        if font:
+            rc['font.family'] = 'sans-serif'
+            rc['font.sans-serif'] = [font]
+            rc['font.weight'] = 'normal'
+        return rc
+
+    def _new_figure(self, width, height):
+        '''
+            Figure with single axes, not registered with pyplot so it can be
+            kept around without being closed
+        '''
+        fig = Figure(
+            figsize = (width/self._dpi, height/self._dpi),
+            dpi = self._dpi,
+            constrained_layout = True,
+            # Style has a grey figure background, which savefig used to
+            # replace by white
+            facecolor = 'white'
+        )
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        return fig, ax
+
+    def _render(self, artists, layout = None):
+        '''
+            Draw figure to image. The layout is only determined when drawing
+            for the first time, or when `layout` (anything else the layout
+            depends on besides size and font) differs from the last drawing
+        '''
+        fig = artists['fig']
+        if artists['layout'] != layout:
+            fig.set_layout_engine('constrained')
+            artists['layout'] = layout
+
+        img = self._fig_to_img(fig)
+        fig.set_layout_engine('none')
+        return img
 
     @staticmethod
     def fakeLog(num, base = 10):
         logBase = np.log10(base)
         return np.log10(np.asarray(num) + 1) / logBase
 
-    def rain(self, canvas, 
+    @staticmethod
+    def _date2num(times):
+        '''
+            Matplotlib dates in local time for an array of unix times,
+            same as date2num of datetime.fromtimestamp for every time
+        '''
+        times = np.asarray(times, dtype = float)
+        # UTC offset at the start, a plot spans only a few hours
+        offset = datetime.fromtimestamp(times[0]).astimezone().utcoffset()
+
+        local = np.round((times + offset.total_seconds()) * 1e6)
+        return mdates.date2num(local.astype('datetime64[us]'))
+
+    @staticmethod
+    @lru_cache(maxsize = 8)
+    def _spline_basis(n, extra, points):
+        '''
+            Matrix mapping n evenly spaced data points plus `extra` points
+            beyond the end onto their cubic spline, evaluated at `points`
+            evenly spaced positions from the first to the n-th data point.
+            The extra points have a slightly smaller spacing, (n - 1) / n
+        '''
+        x = np.concatenate([np.arange(n),
+            n - 1 + (n - 1) / n * np.arange(1, extra + 1)])
+
+        # Spline of the unit vectors, evaluated on the grid
+        spline = make_interp_spline(x, np.eye(n + extra), k=3)
+        return spline(np.linspace(0, n - 1, points))
+
+    def _interp(self, times, data_extend, extra, points):
+        '''
+            Spline through data at times (and extra points after it),
+            evaluated at `points` evenly spaced times
+        '''
+        n = len(times)
+        step = np.diff(times)
+
+        if n > 1 and np.allclose(step, step[0]):
+            # Interpolation only depends on the number of points
+            return self._spline_basis(n, extra, points) @ data_extend
+
+        delta = (times[-1] - times[0]) / n
+        times_extend = np.concatenate([times,
+            times[-1] + delta * np.arange(1, extra + 1)])
+        spline = make_interp_spline(times_extend, data_extend, k=3)
+        return spline(np.linspace(times[0], times[-1], points))
+
+    def _rain_figure(self, width, height, fontsize, xlabel, ylabel, title):
+        '''
+            Create figure and artists for 'rain', data is set later
+        '''
+        fig, ax = self._new_figure(width, height)
+        ax.xaxis_date()
+
+        artists = {'fig': fig, 'ax': ax}
+        # Layout is not known yet
+        artists['layout'] = ()
+
+        # Fill below line
+        artists['fill'] = ax.fill_between(
+            [0, 1],
+            0.0,
+            [0, 0],
+            alpha = 0.3,
+            linewidth = 1
+        )
+        # Draw line
+        artists['line'], = ax.plot(
+            [], [],
+            'k',
+            alpha = 0.5,
+            linewidth = 3
+        )
+        # Original data as points connected by dashed line, for debugging
+        artists['debug'], = ax.plot(
+            [], [],
+            'k--s',
+            alpha = 0.75
+        )
+
+        artists['noRain'] = ax.text(0.5, 0.5, '',
+            va='center', ha='center', transform=ax.transAxes,
+            fontsize=fontsize
+        )
+
+        # Two level lines with text on the right of the plot
+        artists['levels'] = []
+        for i in range(2):
+            l = ax.axhline(0, linestyle='--', linewidth=1.5)
+            t = ax.text(0, 0, '', va='bottom', ha='right')
+            # White stroke behind text
+            t.set_path_effects([
+                path_effects.Stroke(linewidth=3, foreground='w'),
+                path_effects.Normal()
+            ])
+            t.set_clip_on(False) # Fine for text to clip figure
+            l.set_zorder(4) # Draw lines above text
+            artists['levels'].append((l, t))
+
+        # Make x ticks on every 30 minute or full hour
+        ax.xaxis.set_major_locator(mdates.MinuteLocator(byminute = [i*30 for i in range(2)]))
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+
+        # Get rid of Y ticks
+        ax.get_yaxis().set_ticks([])
+
+        # Move X ticks inside plot
+        ax.xaxis.set_tick_params(direction='in', length=8, width=3, pad=5)
+
+        # Disable all spines except bottom, set line width
+        [ax.spines[x].set_visible(False) for x in ['top', 'right', 'left']]
+        ax.spines['bottom'].set_linewidth(3)
+
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+
+        # Move title inwards
+        t = ax.set_title(title, fontsize='medium', y=1.0, pad=-fontsize+2)
+        # White stroke behind title text
+        t.set_path_effects([path_effects.Stroke(linewidth=3, foreground='w'),
+            path_effects.Normal()]) # White stroke behind text
+
+        return artists
+
+    def rain(self, canvas,
         width, height, times, precip, pos = (0,0), font = '',
         fontsize = None, xlabel='', ylabel='', title='', noRainMsg = '',
         levels = None, debug = False):
@@ -62,81 +253,54 @@ class Plot:
         if levels == None:
             levels = {'light': 0.25, 'moderate': 1, 'heavy': 2.5}
 
+        times = np.asarray(times, dtype = float)
+        precip = np.asarray(precip, dtype = float)
+
         dt_start    = datetime.fromtimestamp(times[0])
         dt_end      = datetime.fromtimestamp(times[-1])
 
-        with Plot._lock:
-            # Set global figure parameters
-            if font:
-                plt.rcParams['font.family'] = 'sans-serif'
-                plt.rcParams['font.sans-serif'] = [font]
-                plt.rcParams['font.weight'] = 'normal'
-            plt.rcParams['font.size'] = fontsize
-
-            COLOR = 'k'
-            plt.rcParams['text.color'] = COLOR
-            plt.rcParams['axes.labelcolor'] = COLOR
-            plt.rcParams['xtick.color'] = COLOR
-            plt.rcParams['ytick.color'] = COLOR
+        with Plot._lock, mpl.rc_context(self._rc(font, fontsize)):
+            a = Plot._figures.get(
+                ('rain', width, height, font, fontsize, xlabel, ylabel, title),
+                lambda: self._rain_figure(width, height, fontsize,
+                    xlabel, ylabel, title)
+            )
+            fig, ax = a['fig'], a['ax']
 
             # Transform data to 'logarithmic' scale with base 6
             base = 6
-            precip_log = self.fakeLog(precip, base).tolist()
+            precip_log = self.fakeLog(precip, base)
 
             # Interpolate points for data fitting
             points = 350
             times_unix_interp = np.linspace(times[0], times[-1], points)
-            # Convert interpolated unix times to datetime
-            times_interp = [datetime.fromtimestamp(t)
-                for t in times_unix_interp]
+            # Convert interpolated unix times to matplotlib dates
+            times_interp = self._date2num(times_unix_interp)
 
             # Repeat last data point a few times to tame end of spline
             extra = 5
-            delta = (times[-1] - times[0]) / len(times)
-            times_extend = times + [
-                times[-1] + delta*(i+1) for i in range(extra)]
-            data_extend = precip_log + [precip_log[-1] for i in range(extra)]
+            data_extend = np.concatenate([precip_log,
+                np.repeat(precip_log[-1], extra)])
 
             # Curve fit precipitation using BSpline
-            spline = make_interp_spline(times_extend, data_extend, k=3)
-            precip_interp_log = spline(times_unix_interp)
-
-            # Figure with single axes
-            fig, ax = plt.subplots(
-                figsize = (width/self._dpi, height/self._dpi),
-                dpi = self._dpi,
-                constrained_layout = True
-            )
+            precip_interp_log = self._interp(times, data_extend, extra, points)
 
             # Fill below line
-            ax.fill_between(
-                times_interp,
-                0.0,
-                precip_interp_log,
-                alpha = 0.3,
-                linewidth = 1
-            )
+            a['fill'].set_verts([np.concatenate([
+                [[times_interp[0], 0.0]],
+                np.column_stack([times_interp, precip_interp_log]),
+                [[times_interp[-1], 0.0]]
+            ])])
             # Draw line
-            ax.plot(
-                times_interp,
-                precip_interp_log,
-                'k',
-                alpha = 0.5,
-                linewidth = 3
-            )
+            a['line'].set_data(times_interp, precip_interp_log)
 
             if debug:
-                # Plot original data as points connected by dashed line
-                ax.plot(
-                    [datetime.fromtimestamp(t) for t in times],
-                    precip_log,
-                    'k--s',
-                    alpha = 0.75
-                )
+                a['debug'].set_data(self._date2num(times), precip_log)
+            a['debug'].set_visible(debug)
 
             # Determine levels to show on the plot
             levels_plot = ['light']
-            if max(precip) > levels['heavy']:
+            if precip.max() > levels['heavy']:
                 # Plot light and heavy line
                 levels_plot += ['heavy']
             else:
@@ -145,119 +309,115 @@ class Plot:
 
             # Don't plot lines if no precipitation is expected,
             # instead write a message
-            if max(precip) < levels['light'] / 5:
+            a['noRain'].set_visible(False)
+            if precip.max() < levels['light'] / 5:
                 levels_plot = []
                 if noRainMsg:
-                    t = ax.text(0.5, 0.5, noRainMsg,
-                        va='center', ha='center', transform=ax.transAxes,
-                        color=COLOR, fontsize=fontsize
-                    )
+                    a['noRain'].set_text(noRainMsg)
+                    a['noRain'].set_visible(True)
 
             # Actually plot lines
-            for level in levels_plot:
+            for i, (l, t) in enumerate(a['levels']):
+                visible = i < len(levels_plot)
+                l.set_visible(visible)
+                t.set_visible(visible)
+                if not visible:
+                    continue
+
+                level = levels_plot[i]
                 y = self.fakeLog(levels[level], base)
                 # Draw the line at height y
-                l = ax.axhline(y, label=level, linestyle='--', linewidth=1.5)
+                l.set_ydata([y, y])
+                l.set_label(level)
                 # Draw text on the right of the plot
-                t = ax.text(dt_end, y, level, color=COLOR,
-                    va='bottom', ha='right')
-                # White stroke behind text
-                t.set_path_effects([
-                    path_effects.Stroke(linewidth=3, foreground='w'),
-                    path_effects.Normal()
-                ])
-                t.set_clip_on(False) # Fine for text to clip figure
-                l.set_zorder(4) # Draw lines above text
+                t.set_position((mdates.date2num(dt_end), y))
+                t.set_text(level)
 
             y_min = levels['light'] / 5
-            y_max = 2 + max(levels['moderate'], min(levels['heavy'] * 2, max(precip)))
+            y_max = 2 + max(levels['moderate'], min(levels['heavy'] * 2, precip.max()))
 
             ax.set_ylim(bottom = self.fakeLog(y_min, base))
             ax.set_ylim(top = self.fakeLog(y_max, base))
 
             ax.set_xlim(dt_start, dt_end)
 
-            # Make x ticks on every 30 minute or full hour
-            ax.xaxis.set_major_locator(mdates.MinuteLocator(byminute = [i*30 for i in range(2)]))
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
-
-            # Get rid of Y ticks
-            ax.get_yaxis().set_ticks([])
-
-            # Move X ticks inside plot
-            ax.xaxis.set_tick_params(direction='in', length=8, width=3, pad=5)
-
-            # Move first and last label inwards
+            # Move first and last label inwards, tick labels are reused
+            # so reset earlier alignments first
             labels = ax.get_xticklabels()
+            for label in labels:
+                label.set_ha('center')
             if dt_start.minute == 0 or dt_start.minute == 30:
                 labels[0].set_ha('left')
             if dt_end.minute == 0 or dt_end.minute == 30:
                 labels[-1].set_ha('right')
 
-            # Disable all spines except bottom, set line width
-            [ax.spines[x].set_visible(False) for x in ['top', 'right', 'left']]
-            ax.spines['bottom'].set_linewidth(3)
-
-            ax.set_xlabel(xlabel)
-            ax.set_ylabel(ylabel)
-
-            # Move title inwards
-            t = ax.set_title(title, fontsize='medium', y=1.0, pad=-fontsize+2)
-            # White stroke behind title text
-            t.set_path_effects([path_effects.Stroke(linewidth=3, foreground='w'),
-                path_effects.Normal()]) # White stroke behind text
-
-            img = self._fig_to_img(fig)
-            plt.close(fig)
+            # Tick labels near the edges can change the margins
+            img = self._render(a, (dt_start.minute % 30, dt_end.minute % 30))
 
         box = (
             pos[0], pos[1],
             pos[0] + width, pos[1] + height
         )
-        canvas.paste(img, box)       
+        canvas.paste(img, box)
+
+    def _line_figure(self, width, height, xlabel, ylabel, title):
+        '''
+            Create figure and line for 'line', data is set later
+        '''
+        fig, ax = self._new_figure(width, height)
+
+        line, = ax.plot([], [])
+
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_title(title, fontsize='medium')
+
+        return {'fig': fig, 'ax': ax, 'line': line, 'layout': ()}
+
+    # Reduce long series to the plot width, see helpers/decimate.py
+    decimate = staticmethod(decimate)
 
     def line(self, canvas, width, height, x_data, y_data, pos = (0,0),
-        fontsize = None, xlabel='', ylabel='', title='', legend = False):
+        fontsize = None, xlabel='', ylabel='', title='', legend = False,
+        decimate = 'minmax', start = 0):
         '''
             Basic line plot, not very useful.
+            Long series are decimated to the plot width first (see
+            `decimate`), use decimate = None to plot every point.
+            NumPy ring buffers can be plotted directly, with `start` the
+            index of the oldest point.
         '''
 
         if fontsize == None:
             fontsize = self._default_fontsize
 
-        with Plot._lock:
+        x_data, y_data = self.decimate(x_data, y_data, width, decimate, start)
+
+        with Plot._lock, mpl.rc_context(self._rc(None, fontsize)):
             # Convert lists to numpy
             # TODO: handle multi-dimensional lists/dicts for multiple lines
             x_data = np.asarray(x_data)
             y_data = np.asarray(y_data)
 
-            # Set global figure parameters
-            plt.rcParams['font.size'] = fontsize
-
-            COLOR = 'k'
-            plt.rcParams['text.color'] = COLOR
-            plt.rcParams['axes.labelcolor'] = COLOR
-            plt.rcParams['xtick.color'] = COLOR
-            plt.rcParams['ytick.color'] = COLOR
-
-            # Figure with single axes
-            fig, ax = plt.subplots(
-                figsize = (width/self._dpi, height/self._dpi),
-                dpi = self._dpi,
-                constrained_layout = True
+            a = Plot._figures.get(
+                ('line', width, height, fontsize, xlabel, ylabel, title),
+                lambda: self._line_figure(width, height, xlabel, ylabel, title)
             )
+            fig, ax = a['fig'], a['ax']
 
-            ax.plot(x_data, y_data)
-
-            ax.set_xlabel(xlabel)
-            ax.set_ylabel(ylabel)
-            ax.set_title(title, fontsize='medium')
+            a['line'].set_data(x_data, y_data)
+            ax.relim()
+            ax.autoscale_view()
 
+            legend_artist = ax.get_legend()
             if (legend):
-                ax.legend()
+                if legend_artist == None:
+                    ax.legend()
+            elif legend_artist != None:
+                legend_artist.remove()
 
-            img = self._fig_to_img(fig)
-            plt.close(fig)
+            # Width of the y tick labels depends on the data range
+            img = self._render(a, ax.get_ylim())
 
         box = (
             pos[0], pos[1],
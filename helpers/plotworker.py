@@ -0,0 +1,240 @@
+'''
+    Run matplotlib plots (plot.py) in a separate process
+
+    Has the same functions as `Plot`, but sends the data to a worker process
+    that owns matplotlib. The worker draws the 8-bit image into a shared
+    memory buffer, which is pasted onto the widget's canvas from there.
+    Plotting then runs on another core and does not hold the GIL of the
+    main process, so it doesn't delay fast widgets such as the clock.
+
+    One worker is shared by all widgets, started in the background when the
+    first widget using it is loaded. Enabled with 'plotWorker' in [main]
+    (default yes), 'plotTimeout' is the time (seconds) to wait for a plot.
+    Together with fetching the data it should stay below the scheduler's
+    timeout of 40 s.
+'''
+import logging
+import traceback
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+
+from PIL import Image
+from helpers.decimate import decimate
+
+def _serve(conn, cfg):
+    '''
+        Worker process: draw requested plots until the pipe is closed
+    '''
+    from helpers.plot import Plot
+
+    plot = Plot(cfg)
+    shm = None
+
+    # Importing matplotlib takes a while, let the main process know
+    # when plots can be made
+    conn.send(('ready', None))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+
+        if request == None:
+            break
+
+        function, width, height, args, kwargs, shm_name = request
+
+        try:
+            # Attach to the buffer of the main process, it is replaced
+            # when a larger plot comes along
+            if shm == None or shm.name != shm_name:
+                if shm != None:
+                    shm.close()
+                shm = SharedMemory(name = shm_name)
+
+            img = Image.new('L', (width, height), 0xFF)
+            getattr(plot, function)(img, width, height, *args,
+                pos = (0,0), **kwargs)
+            shm.buf[:width * height] = img.tobytes()
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+        else:
+            conn.send(('ok', None))
+
+    if shm != None:
+        shm.close()
+
+class PlotWorker:
+    # Shared by all widgets
+    _lock = Lock()
+    _process = None
+    _conn = None
+    _shm = None
+    # Whether the worker has finished starting
+    _ready = False
+
+    def __init__(self, cfg):
+        self.logger = logging.getLogger(__name__)
+
+        self.cfg = cfg
+
+        # Seconds to wait for a plot, below the scheduler's timeout
+        self.timeout = float(cfg.get('main', 'plotTimeout', fallback = 15))
+
+        # Start worker now, it has imported matplotlib by the first plot
+        with PlotWorker._lock:
+            if PlotWorker._process == None:
+                self._start()
+
+    def _start(self):
+        # Fresh interpreter, so no locks or threads of this process
+        # end up in the worker
+        ctx = mp.get_context('spawn')
+        conn, child_conn = ctx.Pipe()
+
+        process = ctx.Process(
+            target = _serve,
+            args = (child_conn, self.cfg),
+            name = 'PlotWorker',
+            daemon = True
+        )
+        process.start()
+        child_conn.close()
+
+        PlotWorker._process = process
+        PlotWorker._conn = conn
+        PlotWorker._ready = False
+
+        self.logger.debug('Started plot worker (pid {})'.format(process.pid))
+
+    def _stop(self):
+        if PlotWorker._process == None:
+            return
+
+        try:
+            PlotWorker._conn.send(None)
+        except (OSError, ValueError):
+            pass
+
+        PlotWorker._process.join(1)
+        if PlotWorker._process.is_alive():
+            PlotWorker._process.terminate()
+
+        PlotWorker._conn.close()
+        PlotWorker._process = None
+        PlotWorker._conn = None
+        PlotWorker._ready = False
+
+    def _buffer(self, size):
+        '''
+            Shared memory buffer of at least size bytes
+        '''
+        if PlotWorker._shm != None and PlotWorker._shm.size >= size:
+            return PlotWorker._shm
+
+        if PlotWorker._shm != None:
+            PlotWorker._shm.close()
+            PlotWorker._shm.unlink()
+
+        PlotWorker._shm = SharedMemory(create = True, size = size)
+        return PlotWorker._shm
+
+    def _wait_ready(self):
+        '''
+            Wait for the worker to finish starting, returns whether it did
+        '''
+        if PlotWorker._ready:
+            return True
+
+        if not PlotWorker._conn.poll(self.timeout):
+            # Leave it running, it is still importing
+            self.logger.warning('Plot worker is still starting')
+            return False
+
+        status, _ = PlotWorker._conn.recv()
+        PlotWorker._ready = status == 'ready'
+
+        return PlotWorker._ready
+
+    def _plot(self, function, canvas, width, height, pos, args, kwargs):
+        '''
+            Returns whether the plot was pasted onto the canvas
+        '''
+        with PlotWorker._lock:
+            shm = self._buffer(width * height)
+
+            if PlotWorker._process == None or not PlotWorker._process.is_alive():
+                self._stop()
+                self._start()
+
+            try:
+                if not self._wait_ready():
+                    return False
+
+                PlotWorker._conn.send((function, width, height, args, kwargs,
+                    shm.name))
+
+                if not PlotWorker._conn.poll(self.timeout):
+                    self.logger.error('Plot worker did not respond in time')
+                    # Start over on the next plot
+                    self._stop()
+                    return False
+
+                status, error = PlotWorker._conn.recv()
+            except (EOFError, OSError) as e:
+                self.logger.error('Plot worker stopped: {}'.format(e))
+                self._stop()
+                return False
+
+            if status != 'ok':
+                self.logger.error('Plotting failed in worker:\n{}'.format(error))
+                return False
+
+            img = Image.frombuffer('L', (width, height), shm.buf,
+                'raw', 'L', 0, 1)
+
+            box = (
+                pos[0], pos[1],
+                pos[0] + width, pos[1] + height
+            )
+            canvas.paste(img, box)
+
+            # Release the view on the buffer, so it can be closed later
+            del img
+
+            return True
+
+    def rain(self, canvas, width, height, times, precip, pos = (0,0),
+        **kwargs):
+        '''
+            Same as Plot.rain, returns whether the plot was drawn
+        '''
+        return self._plot('rain', canvas, width, height, pos,
+            (times, precip), kwargs)
+
+    def line(self, canvas, width, height, x_data, y_data, pos = (0,0),
+        **kwargs):
+        '''
+            Same as Plot.line, returns whether the plot was drawn.
+            Long series are decimated here, so only the points that are
+            plotted are sent to the worker
+        '''
+        x_data, y_data = decimate(x_data, y_data, width,
+            kwargs.pop('decimate', 'minmax'), kwargs.pop('start', 0))
+
+        return self._plot('line', canvas, width, height, pos,
+            (x_data, y_data), dict(kwargs, decimate = None))
+
+    def close(self):
+        '''
+            Stop worker and free the shared buffer
+        '''
+        with PlotWorker._lock:
+            self._stop()
+
+            if PlotWorker._shm != None:
+                PlotWorker._shm.close()
+                PlotWorker._shm.unlink()
+                PlotWorker._shm = None
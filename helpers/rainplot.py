@@ -0,0 +1,231 @@
+'''
+    Precipitation plot for the 'Rain' widget, drawn directly with PIL and
+    NumPy at the widget's pixel size
+
+    Looks like `Plot.rain` (plot.py), but does not need matplotlib or scipy.
+    The matplotlib version can still be used by setting
+    `plotter = matplotlib` in the Rain section of the config file.
+'''
+import logging
+from functools import lru_cache
+from datetime import datetime, timedelta
+
+import numpy as np
+from PIL import Image, ImageDraw
+from helpers.textfun import Text
+
+class RainPlot:
+
+    def __init__(self, cfg):
+        self.logger = logging.getLogger(__name__)
+
+        self._default_fontsize = 12
+
+        self.text = Text(cfg)
+
+        # Grey values of the 'grayscale' matplotlib style used by Plot.rain
+        self._fill_alpha = 0.3
+        self._line_alpha = 0.5
+        self._level_col = 102
+
+    @staticmethod
+    def fakeLog(num, base = 10):
+        logBase = np.log10(base)
+        return np.log10(np.asarray(num) + 1) / logBase
+
+    @staticmethod
+    @lru_cache(maxsize = 8)
+    def _spline_basis(n, points, end):
+        '''
+            Matrix that maps n evenly spaced data points onto a natural cubic
+            spline through them, evaluated at `points` evenly spaced positions
+            from the first data point up to index `end`.
+            Only depends on the sizes, so it is computed once.
+        '''
+        x = np.linspace(0, end, points)
+
+        if n < 3:
+            # Not enough points for a spline, interpolate linearly
+            return np.array([np.interp(x, np.arange(n), col)
+                for col in np.eye(n)]).T
+
+        # Second derivatives M from M[i-1] + 4 M[i] + M[i+1] = 6 (D y)[i],
+        # with M = 0 at both ends
+        A = (np.diag(np.full(n - 2, 4.0))
+            + np.diag(np.ones(n - 3), 1)
+            + np.diag(np.ones(n - 3), -1))
+        D = np.zeros((n - 2, n))
+        for i in range(n - 2):
+            D[i, i:i + 3] = [1.0, -2.0, 1.0]
+
+        M = np.zeros((n, n))
+        M[1:-1] = np.linalg.solve(A, 6.0 * D)
+
+        i = np.minimum(x.astype(int), n - 2)
+        t = (x - i)[:, None]
+        I = np.eye(n)
+
+        return ((1 - t) * I[i] + t * I[i + 1]
+            + ((1 - t)**3 - (1 - t)) / 6.0 * M[i]
+            + (t**3 - t) / 6.0 * M[i + 1])
+
+    def _dashed_line(self, draw, xy, fill, width, dash = 6, gap = 3):
+        (x0, y), (x1, _) = xy
+        x = x0
+        while x < x1:
+            draw.line([(x, y), (min(x + dash, x1), y)], fill=fill, width=width)
+            x += dash + gap
+
+    def rain(self, canvas,
+        width, height, times, precip, pos = (0,0), font = '',
+        fontsize = None, xlabel='', ylabel='', title='', noRainMsg = '',
+        levels = None, debug = False):
+        '''
+            Plot function for 'Rain' widget, same arguments as Plot.rain
+        '''
+
+        if fontsize == None:
+            fontsize = self._default_fontsize
+
+        if levels == None:
+            levels = {'light': 0.25, 'moderate': 1, 'heavy': 2.5}
+
+        font = font if font else None
+        dFont = self.text._get_font(font, fontsize)
+
+        img = Image.new('L', (width, height), 0xFF)
+        draw = ImageDraw.Draw(img)
+
+        # Transform data to 'logarithmic' scale with base 6
+        base = 6
+        precip = np.asarray(precip, dtype=float)
+        precip_log = self.fakeLog(precip, base)
+
+        # Plot area, leaving room for tick labels (and axis labels) below
+        pad = 5
+        x0, x1 = 2, width - 3
+        y0 = 2
+        y1 = height - 1 - (fontsize + pad + 4)
+        if xlabel:
+            y1 -= fontsize + pad
+        if ylabel:
+            x0 += fontsize + pad
+
+        y_min = self.fakeLog(levels['light'] / 5, base)
+        y_max = self.fakeLog(2 + max(levels['moderate'],
+            min(levels['heavy'] * 2, precip.max())), base)
+
+        t_start, t_end = times[0], times[-1]
+
+        def x_pos(t):
+            return x0 + (np.asarray(t) - t_start) / (t_end - t_start) * (x1 - x0)
+
+        def y_pos(v):
+            return y1 - (np.asarray(v) - y_min) / (y_max - y_min) * (y1 - y0)
+
+        # Repeat last data point a few times to tame end of spline
+        extra = 5
+        data_extend = np.concatenate([precip_log, np.repeat(precip_log[-1], extra)])
+
+        # Curve fit precipitation, one point per pixel column
+        points = x1 - x0 + 1
+        n = len(precip_log)
+        basis = self._spline_basis(n + extra, points, n - 1)
+        curve = basis @ data_extend
+
+        xs = np.arange(x0, x1 + 1)
+        ys = np.clip(y_pos(curve), y0, y1)
+        line = list(zip(xs.tolist(), ys.tolist()))
+
+        # Fill below line
+        fill = round(0xFF * (1 - self._fill_alpha))
+        draw.polygon(line + [(x1, y1), (x0, y1)], fill=fill)
+
+        # Draw line, half transparent
+        mask = Image.new('L', img.size, 0)
+        ImageDraw.Draw(mask).line(line, fill=round(0xFF * self._line_alpha),
+            width=3, joint='curve')
+        img.paste(0, mask=mask)
+
+        if debug:
+            # Plot original data as points connected by dashed line
+            pts = list(zip(x_pos(times).tolist(), y_pos(precip_log).tolist()))
+            for a, b in zip(pts[:-1], pts[1:]):
+                draw.line([a, b], fill=0x40, width=1)
+            for x, y in pts:
+                draw.rectangle([x - 2, y - 2, x + 2, y + 2], fill=0x40)
+
+        # Determine levels to show on the plot
+        levels_plot = ['light']
+        if precip.max() > levels['heavy']:
+            # Plot light and heavy line
+            levels_plot += ['heavy']
+        else:
+            # Plot light and moderate line
+            levels_plot += ['moderate']
+
+        # Don't plot lines if no precipitation is expected,
+        # instead write a message
+        if precip.max() < levels['light'] / 5:
+            levels_plot = []
+            if noRainMsg:
+                draw.text(((x0 + x1) // 2, (y0 + y1) // 2), noRainMsg,
+                    font=dFont, fill=0, anchor='mm')
+
+        for level in levels_plot:
+            y = float(y_pos(self.fakeLog(levels[level], base)))
+            # Text on the right of the plot, white stroke behind it
+            draw.text((x1, y - 1), level, font=dFont, fill=0, anchor='rd',
+                stroke_width=1, stroke_fill=0xFF)
+            # Draw the line at height y, above the text
+            self._dashed_line(draw, [(x0, y), (x1, y)],
+                fill=self._level_col, width=2)
+
+        # Bottom axis line
+        draw.line([(x0, y1), (x1, y1)], fill=0, width=3)
+
+        # Ticks on every 30 minute or full hour, inside the plot
+        dt_start = datetime.fromtimestamp(t_start)
+        dt_end = datetime.fromtimestamp(t_end)
+
+        tick = dt_start.replace(second=0, microsecond=0)
+        tick += timedelta(minutes = -tick.minute % 30)
+        if tick < dt_start:
+            tick += timedelta(minutes = 30)
+
+        while tick <= dt_end:
+            x = float(x_pos(tick.timestamp()))
+            draw.line([(x, y1), (x, y1 - 8)], fill=0, width=3)
+
+            # Move first and last label inwards
+            anchor = 'ma'
+            if tick == dt_start:
+                anchor = 'la'
+            elif tick == dt_end:
+                anchor = 'ra'
+            draw.text((x, y1 + pad), tick.strftime('%H:%M'), font=dFont,
+                fill=0, anchor=anchor)
+
+            tick += timedelta(minutes = 30)
+
+        if xlabel:
+            draw.text(((x0 + x1) // 2, height - 1), xlabel, font=dFont,
+                fill=0, anchor='md')
+
+        if ylabel:
+            w, h = self.text.size(img, ylabel, font=font, fontsize=fontsize)
+            label = Image.new('L', (w, h + pad), 0xFF)
+            ImageDraw.Draw(label).text((0, 0), ylabel, font=dFont, fill=0)
+            label = label.rotate(90, expand=True)
+            img.paste(label, (0, (y0 + y1 - label.height) // 2))
+
+        # Title inside the plot, white stroke behind it
+        if title:
+            draw.text(((x0 + x1) // 2, y0), title, font=dFont, fill=0,
+                anchor='ma', stroke_width=1, stroke_fill=0xFF)
+
+        box = (
+            pos[0], pos[1],
+            pos[0] + width, pos[1] + height
+        )
+        canvas.paste(img, box)
@@ -0,0 +1,55 @@
+'''
+    Keep the last good data of a widget on disk, so it can be drawn right
+    after a restart while fresh data is still being fetched
+
+    One file per widget (config section name) in 'snapshotDir' in [main],
+    default cache/snapshots. An empty 'snapshotDir' disables snapshots.
+'''
+import os
+import time
+import pickle
+import logging
+
+class Snapshot:
+
+    def __init__(self, cfg, name):
+        self.logger = logging.getLogger(__name__)
+
+        self.dir = cfg.get('main', 'snapshotDir', fallback = 'cache/snapshots')
+        self.path = os.path.join(self.dir, '{}.pickle'.format(name))
+
+    def save(self, data):
+        '''
+            Store data (anything that can be pickled) with the current time
+        '''
+        if not self.dir:
+            return
+
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            os.makedirs(self.dir, exist_ok = True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'timestamp': time.time(), 'data': data}, f,
+                    protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except (OSError, pickle.PicklingError) as e:
+            self.logger.warning('Could not save snapshot {}: {}'.format(
+                self.path, e))
+
+    def load(self):
+        '''
+            Returns stored data and the time (unix) it was saved,
+            or (None, None) if there is no snapshot
+        '''
+        if not self.dir:
+            return None, None
+
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = pickle.load(f)
+            return snapshot['data'], snapshot['timestamp']
+        except FileNotFoundError:
+            return None, None
+        except Exception as e:
+            self.logger.warning('Invalid snapshot {}: {}'.format(self.path, e))
+            return None, None
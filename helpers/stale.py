@@ -0,0 +1,208 @@
+'''
+    Stale-while-revalidate for data that widgets fetch over the network
+
+    `get()` returns the data kept in memory right away, and refreshes it in a
+    background thread once per interval. Drawing then doesn't wait for the
+    network. Only when there is no data yet, or it is past its hard expiry,
+    `get()` waits for the fetch.
+
+    Widgets draw once per interval, so a refresh started while drawing would
+    only be shown an interval later. Instead `get()` sets a timer to refresh
+    a little before the next draw (a quarter of the interval, at most a
+    minute), and the data drawn is at most that old.
+
+    Settings in the widget's config section (minutes), the widget gives the
+    defaults:
+        maxAge      data older than this is stale, e.g. after a failed fetch.
+                    With 'staleBadge = yes' its age is shown on the widget
+        hardExpiry  data older than this is not shown anymore
+'''
+import time
+import logging
+from threading import Thread, Lock, Timer
+from PIL import ImageDraw
+from helpers.textfun import Text
+
+class StaleData:
+
+    def __init__(self, cfg, name, fetch, interval, maxAge, hardExpiry):
+        '''
+            fetch: function returning (data, unchanged). data is None
+                when fetching failed, unchanged means the data is the same
+                as the previous fetch (data may then be None as well)
+            interval: minutes between refreshes
+        '''
+        self.logger = logging.getLogger(__name__)
+
+        self.name = name
+        self.fetch = fetch
+
+        # All in seconds
+        self.interval = 60 * float(interval)
+        # Refresh this long before the next draw
+        self.ahead = min(60, self.interval / 4)
+        self.maxAge = 60 * float(cfg.get(name, 'maxAge', fallback = maxAge))
+        self.hardExpiry = 60 * float(cfg.get(name, 'hardExpiry',
+            fallback = hardExpiry))
+        self.badge = cfg.getboolean(name, 'staleBadge',
+            fallback = cfg.getboolean('main', 'staleBadge', fallback = False))
+
+        self.text = Text(cfg)
+
+        self._lock = Lock()
+        self._thread = None
+        self._timer = None
+        # Start of the last refresh
+        self._refreshed = None
+
+        self.data = None
+        # Time (unix) of the last successful fetch
+        self.timestamp = None
+
+    def seed(self, data, timestamp):
+        '''
+            Start with data fetched at timestamp (unix), e.g. from a snapshot
+        '''
+        with self._lock:
+            if self.timestamp == None:
+                self.data = data
+                self.timestamp = timestamp
+
+    def _update(self):
+        try:
+            data, unchanged = self.fetch()
+        except Exception:
+            self.logger.error('Fetching data for {} failed'.format(self.name),
+                exc_info = True)
+            return
+
+        with self._lock:
+            if unchanged and self.data != None:
+                self.timestamp = time.time()
+            elif data != None:
+                self.data = data
+                self.timestamp = time.time()
+
+    def refresh(self, wait = False):
+        '''
+            Fetch data in the background, unless that is already going on.
+            With wait = True, return once it is done
+        '''
+        with self._lock:
+            if self._thread == None or not self._thread.is_alive():
+                self._refreshed = time.time()
+                self._thread = Thread(
+                    target = self._update,
+                    name = '{} refresh'.format(self.name),
+                    daemon = True
+                )
+                self._thread.start()
+            thread = self._thread
+
+        if wait:
+            thread.join()
+
+    def get(self, refresh = True):
+        '''
+            Returns the data and its age (seconds). Data is None if it
+            expired, age is None if there never was any.
+            With refresh = False the network is left alone.
+        '''
+        now = time.time()
+
+        if refresh:
+            if self.timestamp == None or now - self.timestamp >= self.hardExpiry:
+                # Nothing to show, so wait for it
+                self.refresh(wait = True)
+            elif (self._refreshed == None
+                or now - self._refreshed >= self.interval):
+                # Timer didn't run in time, e.g. drawing was late
+                self.refresh()
+
+            self._schedule()
+
+        with self._lock:
+            if self.timestamp == None:
+                return None, None
+
+            age = time.time() - self.timestamp
+            if age >= self.hardExpiry:
+                return None, age
+
+            return self.data, age
+
+    def _schedule(self):
+        '''
+            Refresh shortly before the next draw, one interval from now,
+            unless a refresh is planned already
+        '''
+        with self._lock:
+            if self._timer != None and self._timer.is_alive():
+                return
+
+            self._timer = Timer(self.interval - self.ahead, self.refresh)
+            self._timer.name = '{} refresh timer'.format(self.name)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def noDataText(self, age):
+        '''
+            Message for a widget that has no data to show, age as
+            returned by get()
+        '''
+        msg = 'No current data (last successful fetch: '
+        if age == None:
+            return msg + 'never)'
+        elif age < 86400:
+            return msg + '{} hours ago)'.format(int(age / 3600))
+        return msg + '{} days ago)'.format(int(age / 86400))
+
+    def badgeText(self, age):
+        '''
+            Text telling the age of stale data, None if not stale
+            or the badge is disabled
+        '''
+        if not self.badge or age == None or age < self.maxAge:
+            return None
+
+        minutes = int(age / 60)
+        if minutes < 120:
+            return '{} min old'.format(minutes)
+        return '{} h old'.format(minutes // 60)
+
+    def drawBadge(self, ops, age, font = None, fontsize = 14, padding = 2):
+        '''
+            Add the age of stale data to the top right corner of a widget
+            drawn with a DrawList (white text on black)
+        '''
+        text = self.badgeText(age)
+        if text == None:
+            return
+
+        width = ops.canvas.width
+        w, _ = self.text.size(ops.canvas, text, font = font,
+            fontsize = fontsize)
+        ops.rectangle((width - w - 2 * padding, 0,
+            width - 1, fontsize + 2 * padding), fill = 0)
+        ops.write(text, pos = (width - padding, padding), font = font,
+            fontsize = fontsize, fill = 0xFF, anchor = 'ra')
+
+    def pasteBadge(self, canvas, age, font = None, fontsize = 14,
+        padding = 2):
+        '''
+            Same as drawBadge, directly on the canvas.
+            Returns whether a badge was drawn
+        '''
+        text = self.badgeText(age)
+        if text == None:
+            return False
+
+        width = canvas.width
+        w, _ = self.text.size(canvas, text, font = font, fontsize = fontsize)
+        draw = ImageDraw.Draw(canvas)
+        draw.rectangle((width - w - 2 * padding, 0,
+            width - 1, fontsize + 2 * padding), fill = 0)
+        self.text.write(canvas, text, pos = (width - padding, padding),
+            font = font, fontsize = fontsize, fill = 0xFF, anchor = 'ra')
+
+        return True
@@ -5,13 +5,14 @@
     Fonts are probably in /usr/share/fonts/truetype/
 '''
 import logging
-from threading import Lock
 from PIL import Image, ImageDraw, ImageFont
+from helpers.cache import LRUCache
 
 class Text:
     # Class variable stores all instances of previously used fonts with sizes
-    _fonts = {}
-    _lock = Lock()
+    _fonts = LRUCache('fonts', budget = 64)
+    # Font sizes found by fit(), per text, font and box
+    _fits = LRUCache('text fits', budget = 256)
 
     def __init__(self, cfg):
         self.logger = logging.getLogger(__name__)
@@ -25,10 +26,10 @@ class Text:
         if fontsize == None:
             fontsize = self._default_size
 
-        if font in Text._fonts:
-            if fontsize in Text._fonts[font]:
-                return Text._fonts[font][fontsize]
+        return Text._fonts.get((font, fontsize),
+            lambda: self._load_font(font, fontsize))
 
+    def _load_font(self, font, fontsize):
         try:
             newFont = ImageFont.truetype('{}.ttf'.format(font), fontsize)
         except OSError:
@@ -41,12 +42,6 @@ class Text:
         else:
             self.logger.debug('Loaded font {} size {}'.format(font, fontsize))
 
-        with Text._lock:
-            if font not in Text._fonts:
-                Text._fonts[font] = {}
-
-            # Add to dict
-            Text._fonts[font][fontsize] = newFont
         return newFont
 
     def bbox(self, buffer, text, pos = (0,0), font = None,
@@ -78,25 +73,35 @@ class Text:
         if w <= max_width:
             draw.text(pos, text, font=dFont, fill=fill, anchor=anchor)
             return
-        
+
+        line = self._truncate(draw, dFont, text, max_width)
+        draw.text(pos, line, font=dFont, fill=fill, anchor=anchor)
+
+    @staticmethod
+    def _truncate(draw, dFont, text, max_width):
+        '''
+            Cut off text at the last word that fits max_width, ending in '..'
+        '''
+        def width(string):
+            bbox = draw.textbbox((0,0), string, dFont)
+            return abs(bbox[2] - bbox[0])
+
         line = ''
-        
+
         for word in text.split():
             tmp = ' '.join([line, word]) if line != '' else word
-            w, _ = self.size(buffer, tmp, pos, font=font, fontsize=fontsize)
-            
+            w = width(tmp)
+
             if w <= max_width:
                 line = tmp
             else:
-                while w > max_width:
+                while w > max_width and word:
                     word = word[:-1]
                     tmp = ' '.join([line, word]) if line != '' else word
-                    w, _ = self.size(buffer, tmp, pos, font=font, fontsize=fontsize)
+                    w = width(tmp)
                 line = tmp[:-1] + '..'
                 break
-        draw.text(pos, line, font=dFont, fill=fill, anchor=anchor)
-            
-        
+        return line
 
     def centered(self, buffer, text, offset = (0,0), font = None,
                     fontsize = None, fill = None, anchor = 'mm'):
@@ -104,6 +109,60 @@ class Text:
         pos = (buf_width // 2 + offset[0], buf_height // 2 + offset[1])
         self.write(buffer, text, pos, font, fontsize, fill, anchor)
 
+    def fit(self, buffer, text, width, height = None, font = None,
+        max_size = None, min_size = 8, max_lines = 1, spacing = 0):
+        '''
+            Find the largest font size for which text fits in a box of
+            width (and optionally height), using at most max_lines lines
+            as laid out by textbox. Results are remembered, so a redraw
+            with the same text and box does not measure anything.
+            Returns min_size if the text does not fit at all.
+        '''
+        if max_size == None:
+            max_size = self._default_size
+
+        key = (text, font, width, height, max_size, min_size, max_lines,
+            spacing)
+
+        return Text._fits.get(key, lambda: self._fit(buffer, text, width,
+            height, font, max_size, min_size, max_lines, spacing))
+
+    def _fit(self, buffer, text, width, height, font, max_size, min_size,
+        max_lines, spacing):
+        def fits(fontsize):
+            if max_lines == 1:
+                lines = [text]
+            else:
+                lines = self._split_lines(buffer, text, width,
+                    font = font, fontsize = fontsize)
+                if len(lines) > max_lines:
+                    return False
+
+            for line in lines:
+                w, h = self.size(buffer, line, font=font, fontsize=fontsize)
+                if w > width or not line:
+                    return False
+
+            if height != None:
+                if max_lines == 1:
+                    return h <= height
+                return len(lines) * (fontsize + spacing) - spacing <= height
+
+            return True
+
+        # Binary search for the largest size that fits
+        low, high = min_size, max_size
+        fontsize = min_size
+        while low <= high:
+            mid = (low + high) // 2
+            if fits(mid):
+                fontsize = mid
+                low = mid + 1
+            else:
+                high = mid - 1
+
+        return fontsize
+
     def textbox(self, buffer, text, width, pos = (0,0), max_lines = None,
         font = None, fontsize = None, fill = None, spacing = 0, **kwargs):
         '''
@@ -114,23 +173,8 @@ class Text:
         if fontsize == None:
             raise ValueError("Font size needs to be specified!")
 
-        # Split text into separate lines first
-        lines = []
-        cur_line = ''
-        for word in text.split():
-            tmp = ' '.join([cur_line, word]) if cur_line != '' else word
-            size = self.size(buffer, tmp, pos, font=font, fontsize=fontsize, **kwargs)
-            if size[0] <= width:
-                cur_line = tmp
-            else:
-                lines.append(cur_line)
-                cur_line = word
-                if max_lines != None and len(lines) >= max_lines:
-                    lines[-1] += '..'
-                    break
-
-        if cur_line and (max_lines == None or len(lines) < max_lines):
-            lines.append(cur_line)
+        lines = self._split_lines(buffer, text, width, pos, max_lines,
+            font, fontsize, **kwargs)
 
         hh = pos[1]
 
@@ -150,3 +194,27 @@ class Text:
         hh = max(hh, fontsize)
 
         return (width, hh - pos[1])
+
+    def _split_lines(self, buffer, text, width, pos = (0,0), max_lines = None,
+        font = None, fontsize = None, **kwargs):
+        '''
+            Split text into lines no wider than width, as used by textbox
+        '''
+        lines = []
+        cur_line = ''
+        for word in text.split():
+            tmp = ' '.join([cur_line, word]) if cur_line != '' else word
+            size = self.size(buffer, tmp, pos, font=font, fontsize=fontsize, **kwargs)
+            if size[0] <= width:
+                cur_line = tmp
+            else:
+                lines.append(cur_line)
+                cur_line = word
+                if max_lines != None and len(lines) >= max_lines:
+                    lines[-1] += '..'
+                    break
+
+        if cur_line and (max_lines == None or len(lines) < max_lines):
+            lines.append(cur_line)
+
+        return lines
@@ -13,38 +13,47 @@ import argparse
 from threading import Thread
 from time import sleep, perf_counter
 from PIL import Image, ImageOps, ImageDraw
-from scheduler import Scheduler, Metronome
-from helpers.testfun import runWidget
 
+# Everything at import time is kept to a minimum: the plot worker process
+# (helpers/plotworker.py) imports this module again when it starts
 display = None
 canvas = None
+config = None
+scheduler = None
+logger = logging.getLogger(__name__)
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-c", "--config", nargs = '?', dest = "configFile",
-    help = "Name of config file to use", default = "config.ini")
-parser.add_argument("-t", "--test", nargs = '?', dest = "testWidget",
-    help = "Widget (name of config file section) to run once")
-
-args = parser.parse_args()
-
-config = configparser.ConfigParser()
-try:
-    if config.read(args.configFile) == []:
-        print(f"Config file {args.configFile} does not exist or is empty!")
+def configure():
+    '''
+        Parse arguments, read config file and set up logging
+    '''
+    global config
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", nargs = '?', dest = "configFile",
+        help = "Name of config file to use", default = "config.ini")
+    parser.add_argument("-t", "--test", nargs = '?', dest = "testWidget",
+        help = "Widget (name of config file section) to run once")
+
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    try:
+        if config.read(args.configFile) == []:
+            print(f"Config file {args.configFile} does not exist or is empty!")
+            sys.exit(1)
+    except Exception as e:
+        print("Error reading config file: {}".format(e))
         sys.exit(1)
-except Exception as e:
-    print("Error reading config file: {}".format(e))
-    sys.exit(1)
 
-quiet = config.getboolean('main', 'quiet', fallback = False)
-debug = config.getboolean('main', 'debug', fallback = True)
+    quiet = config.getboolean('main', 'quiet', fallback = False)
+    debug = config.getboolean('main', 'debug', fallback = True)
 
-logLevel = logging.DEBUG if debug else (
-    logging.WARNING if quiet else logging.INFO)
-logging.basicConfig(level = logLevel, 
-    format = '%(levelname)s (%(name)s): %(message)s')
-logger = logging.getLogger(__name__)
+    logLevel = logging.DEBUG if debug else (
+        logging.WARNING if quiet else logging.INFO)
+    logging.basicConfig(level = logLevel, 
+        format = '%(levelname)s (%(name)s): %(message)s')
 
+    return args
 
 def init():
     '''
@@ -71,11 +80,19 @@ def signal_handler(sig, frame):
     logger.info("Received {}, shutting down..".format(
         signal.Signals(sig).name
     ))
+    from scheduler import Metronome
     Metronome._instance.stop()
     scheduler.unloadWidgets()
     sys.exit(0)
 
-if __name__ == '__main__':
+def main():
+    global scheduler
+
+    args = configure()
+
+    from scheduler import Scheduler, Metronome
+    from helpers.testfun import runWidget
+
     init()
 
     if args.testWidget:
@@ -84,7 +101,10 @@ if __name__ == '__main__':
 
     scheduler = Scheduler(config, display, canvas)
     scheduler.loadWidgets()
+    scheduler.preloadIcons()
 
+    # Show last known data right away, then fetch and draw fresh data
+    scheduler.drawSnapshots()
     scheduler.populateDisplay()
 
     # Seconds between runs of refreshDisplay()
@@ -114,3 +134,6 @@ if __name__ == '__main__':
     # Wait indefinitely for signals
     while True:
         signal.pause()
+
+if __name__ == '__main__':
+    main()
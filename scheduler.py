@@ -11,6 +11,8 @@ from datetime import datetime, timedelta
 from importlib import import_module
 from string import digits
 from helpers.imagefun import ImageFun
+from helpers.cache import LRUCache
+from helpers.http import HTTP
 
 class Metronome:
     '''
@@ -129,6 +131,9 @@ class Scheduler:
         self.logger.debug("Row height: {} px, col width: {} px".format(
             row_height, col_width))
 
+        # Time spent importing and initialising each widget
+        loadTimes = []
+
         for widget in config.sections():
             if widget == 'main':
                 continue
@@ -151,16 +156,17 @@ class Scheduler:
             wdgClassName = widget.rstrip(digits)
 
             try:
-                wdgClass = getattr(
-                    import_module('widgets.{}'.format(wdgClassName)),
-                    wdgClassName
-                )
+                tic = time.perf_counter()
+                module = import_module('widgets.{}'.format(wdgClassName))
+                toc = time.perf_counter()
+                wdgClass = getattr(module, wdgClassName)
                 wList = self.fastWidgets if fastUpdate else self.regularWidgets
                 wList.append(wdgClass(widget, config,
                     width = width,
                     height = height,
                     pos = pos
                 ))
+                tac = time.perf_counter()
             except Exception as e:
                 self.logger.warning("Failed to add widgets.{} as {}".format(wdgClassName, widget))
                 self.logger.warning("{}".format(e))
@@ -168,12 +174,80 @@ class Scheduler:
             else:
                 self.logger.debug("Imported widgets.{} as {} ({})".format(wdgClassName, widget,
                     'fast' if fastUpdate else 'normal'))
+                loadTimes.append((widget, toc - tic, tac - toc))
             
         self.logger.info("Imported {} widgets".format(
             len(self.fastWidgets) + len(self.regularWidgets)))
+        self.logLoadTimes(loadTimes)
         if len(self.fastWidgets) != 0:
             self.fastUpdates = True
 
+    def logLoadTimes(self, loadTimes):
+        '''
+            Report time spent on loading each widget, slowest first.
+            Modules shared between widgets count for the first one loaded
+        '''
+        for widget, importTime, initTime in sorted(loadTimes,
+            key = lambda t: t[1] + t[2], reverse = True):
+            self.logger.info('Loading {}: import {:.1f} ms, init {:.1f} ms'.format(
+                widget, 1000.0 * importTime, 1000.0 * initTime
+            ))
+
+        self.logger.info('Loading widgets took {:.1f} ms'.format(
+            1000.0 * sum(t[1] + t[2] for t in loadTimes)
+        ))
+
+    def preloadIcons(self):
+        '''
+            Rasterize the icons widgets can use before the first redraw,
+            so the first draw of a widget doesn't have to
+        '''
+        icons = []
+        rotated = []
+        for widget in self.regularWidgets + self.fastWidgets:
+            if hasattr(widget, 'icons'):
+                icons += widget.icons()
+            if hasattr(widget, 'rotatedIcons'):
+                rotated += widget.rotatedIcons()
+
+        if not icons and not rotated:
+            return
+
+        from helpers.fontawesome import FontAwesome
+
+        tic = time.perf_counter()
+        fa = FontAwesome(self.config)
+        fa.preload(icons)
+
+        # Rotations are made from the icons loaded above
+        for icon, size, angle in rotated:
+            fa.get_rotated_icon(icon, size, angle)
+        toc = time.perf_counter()
+
+        self.logger.debug('Preloading {} icons took {:.1f} ms'.format(
+            len(set(icons)), 1000.0 * (toc - tic)
+        ))
+
+    def logStats(self):
+        '''
+            Log statistics of the shared (font, icon, ..) caches and
+            the state of the HTTP circuit breakers
+        '''
+        for name, cache in LRUCache.instances.items():
+            stats = cache.stats()
+            self.logger.debug(
+                'Cache {}: {} entries ({} of {}), {} hits, {} misses, {} evicted'.format(
+                    name, stats['entries'], stats['size'], stats['budget'],
+                    stats['hits'], stats['misses'], stats['evictions']
+            ))
+
+        for host, breaker in HTTP.stats().items():
+            self.logger.debug(
+                'Host {}: {}, {} failures, opened {} times, {} requests rejected'.format(
+                    host, breaker['state'], breaker['failures'],
+                    breaker['opened'], breaker['rejected']
+            ))
+
     def unloadWidgets(self):
         '''
             Cleanup widgets and shut down worker pools
@@ -295,6 +369,48 @@ class Scheduler:
         pool.terminate()
 
 
+    def drawSnapshots(self):
+        '''
+            Show widgets with the data they had before the last restart,
+            while populateDisplay() fetches fresh data.
+            Fast widgets don't need a snapshot and are drawn as usual
+        '''
+        tic = time.perf_counter()
+
+        now = datetime.now()
+        drawn = 0
+        for widget in self.regularWidgets:
+            if not hasattr(widget, 'drawSnapshot'):
+                continue
+
+            try:
+                if not widget.drawSnapshot(datetime = now):
+                    continue
+            except Exception as e:
+                self.logger.warning('Drawing snapshot of {} failed: {}'.format(
+                    widget.name, e))
+                continue
+
+            with self.regularLock:
+                self.updatedRegularWidgets.append(widget)
+            drawn += 1
+
+        if drawn == 0:
+            return
+
+        self.redrawFastWidgets(now)
+        [w['worker'].wait(2) for w in self.workers]
+
+        self.pasteFastWidgets()
+        self.pasteRegularWidgets()
+        self.display.updateBuf(self.canvas)
+        self.display.refresh(greyscale = True, partial = False, flash = True)
+
+        toc = time.perf_counter()
+        self.logger.info('Drawing {} widgets from snapshots took {:.1f} ms'.format(
+            drawn, 1000.0 * (toc - tic)
+        ))
+
     def populateDisplay(self):
         tic = time.perf_counter()
         self.logger.debug('Drawing regular widgets..')
@@ -316,6 +432,8 @@ class Scheduler:
         self.display.updateBuf(self.canvas)
         self.display.refresh(greyscale = True, partial = False, flash = True)
 
+        self.logStats()
+
     def refreshDisplay(self, now = None):
         '''
             Refresh display and schedule redraw of widgets.
@@ -354,6 +472,7 @@ class Scheduler:
             if now.minute == 0:
                 self.display.refresh(greyscale = True, 
                     partial = False, flash = True)
+                self.logStats()
             else:
                 self.display.refresh(greyscale = True,
                     partial = True, flash = False)
@@ -7,7 +7,8 @@
 import logging
 from PIL import Image
 from helpers.textfun import Text
-from helpers.fontawesome import FontAwesome
+from helpers.drawlist import DrawList
+from helpers.snapshot import Snapshot
 from datetime import date, datetime, timedelta    
 
 class Calendar:
@@ -60,8 +61,10 @@ class Calendar:
 
         # Text manipulation
         self.text = Text(cfg)
-        # Icons
-        self.fa = FontAwesome(cfg)
+        # Text and icons are drawn in one batch
+        self.ops = DrawList(cfg, self.canvas)
+        # Last calendar items on disk
+        self.snapshot = Snapshot(cfg, self.name)
 
     def _dates_ahead(self, dt):
         today = dt.date()
@@ -79,25 +82,25 @@ class Calendar:
 
         if title:
             titleSize = self.fontSize + 2
-            self.text.write(self.canvas, 
+            self.ops.write(
                 title,
                 pos = (self.margin, self.vertPos),
                 font = self.font, fontsize = titleSize)
             self.vertPos += titleSize + self.spacing
 
         if not items:
-            self.fa.paste_icon(self.canvas,
+            self.ops.icon(
                 'regular/calendar-check', self.fontSize - 2,
                 (self.margin, self.vertPos + 1)
             )
-            self.text.write(self.canvas, 
+            self.ops.write(
                 'No calendar items.',
                 pos = (int(self.fontSize * 1.2) + self.margin, self.vertPos),
                 font = self.font, fontsize = self.fontSize)
             self.vertPos += self.fontSize + self.spacing
 
         for item in items:
-            self.fa.paste_icon(self.canvas,
+            self.ops.icon(
                 'regular/calendar', self.fontSize - 2,
                 (self.margin, self.vertPos + 1)
             )
@@ -118,7 +121,7 @@ class Calendar:
             else:
                 max_width = self.width - self.margin - textPos[0]
 
-            box_size = self.text.textbox(self.canvas,
+            box_size = self.ops.textbox(
                 '{}'.format(item['summary']),
                 max_width,
                 pos = textPos,
@@ -129,9 +132,9 @@ class Calendar:
             )
 
             if time:
-                self.canvas.paste(0xFF, box=tuple(timeBox))
+                self.ops.rectangle(timeBox, fill = 0xFF)
 
-                self.text.write(self.canvas, 
+                self.ops.write(
                     '{}'.format(time),
                     pos = (self.width - self.margin, self.vertPos),
                     font = self.font, fontsize = self.fontSize,
@@ -141,28 +144,19 @@ class Calendar:
             if self.vertPos > (self.height - self.fontSize):
                 return
 
-    def draw(self, **kwargs):
-
-        # Clear canvas
-        self.canvas.paste(0xFF, box=(0, 0, self.width, self.height))
-
-        dt = kwargs.get('datetime')
-
+    def _draw_title(self, dt):
         # Format date, default as 'Tuesday 14 Dec'
         dateString = dt.strftime(self.dateFmt)
 
-        titleSize = self.titleSize
-
         # Decrease title size if it doesn't fit
-        while titleSize > 8 and (
-            self.text.size(
-                self.canvas, dateString, font = self.font,
-                fontsize = titleSize)[0] > self.textWidth
-            ):
-            self.logger.debug('Title size {} too big'.format(titleSize))
-            titleSize = titleSize - 2
-
-        self.text.write(self.canvas, 
+        titleSize = self.text.fit(self.canvas,
+            dateString,
+            self.textWidth,
+            font = self.font,
+            max_size = self.titleSize
+        )
+
+        self.ops.write(
             dateString,
             pos = (self.margin, self.margin),
             font = self.font, fontsize = titleSize, anchor = 'la')
@@ -170,8 +164,36 @@ class Calendar:
         # Keep track of vertical position
         self.vertPos = self.margin + titleSize + self.spacing
 
+    def _draw_items(self, dt, items):
+        '''
+            Draw items per day, a dict of {days ahead: items}
+        '''
+        dates_ahead = self._dates_ahead(dt)
+
+        for days, ddate in enumerate(dates_ahead):
+
+            items_day = items.get(days, [])
+
+            if days == 0:
+                dateStr = '' #'Today'
+            elif days == 1:
+                dateStr = 'Tomorrow'
+            else:
+                dateStr = ddate.strftime('%A')
+
+            self.cal_list(dateStr, items_day)
+
+            if self.vertPos >= (self.height - self.fontSize - self.spacing):
+                break
+
+    def draw(self, **kwargs):
+
+        dt = kwargs.get('datetime')
+
+        self._draw_title(dt)
+
         if not self.provider:
-            self.text.textbox(self.canvas,
+            self.ops.textbox(
                 'No calendar provider configured',
                 self.width - 2 * self.margin,
                 pos = (self.margin, self.vertPos * 2),
@@ -179,32 +201,71 @@ class Calendar:
                 fontsize = self.fontSize,
                 spacing = (self.spacing // 2)
             )
+            self.ops.render()
             return self
 
         ## Start populating calendar items
         items = self.provider.get_calendar_items(dt, self.days_ahead)
 
-        dates_ahead = self._dates_ahead(dt)
+        if items == None:
+            # Provider failed, show the last good items instead
+            items = self._snapshot_items(dt)
+            if items == None:
+                items = {}
+        else:
+            self.snapshot.save(items)
 
-        for days, ddate in enumerate(dates_ahead):
+        self._draw_items(dt, items)
 
-            # Filter items by day
-            items_day = [it for it in items if it['days_ahead'] == days]
+        self.ops.render()
 
-            if days == 0:
-                dateStr = '' #'Today'
-            elif days == 1:
-                dateStr = 'Tomorrow'
-            else:
-                dateStr = ddate.strftime('%A')
+        return self
 
-            self.cal_list(dateStr, items_day)
+    def _snapshot_items(self, dt):
+        '''
+            Last good calendar items from disk, counted from the day of dt.
+            None if there is no snapshot
+        '''
+        items, timestamp = self.snapshot.load()
 
-            if self.vertPos >= (self.height - self.fontSize - self.spacing):
-                break
+        if items == None:
+            return None
 
-        return self
+        # Days ahead were counted from the day the items were saved
+        shift = (dt.date() - date.fromtimestamp(timestamp)).days
+        return {days - shift: items_day for days, items_day in items.items()
+            if days >= shift}
+
+    def drawSnapshot(self, **kwargs):
+        '''
+            Draw the last calendar items from disk, without fetching.
+            Returns whether anything was drawn
+        '''
+        if not self.provider:
+            return False
+
+        dt = kwargs.get('datetime')
+
+        items = self._snapshot_items(dt)
+        if items == None:
+            return False
+
+        self._draw_title(dt)
+        self._draw_items(dt, items)
+
+        self.ops.render()
+
+        return True
 
 
     def getCanvas(self):
         return self.canvas
+
+    def icons(self):
+        '''
+            Icons and sizes this widget can draw, to rasterize ahead of time
+        '''
+        return [
+            ('regular/calendar', self.fontSize - 2),
+            ('regular/calendar-check', self.fontSize - 2)
+        ]
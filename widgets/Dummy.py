@@ -76,6 +76,11 @@ class Dummy:
     def getCanvas(self):
         return self.canvas
 
+    def icons(self):
+        # Optional: list the FontAwesome (icon, size) pairs this widget draws,
+        # these are rasterized before the first redraw
+        return []
+
     def cleanup(self):
         # Add code that runs before the display is shut down here (e.g. saving a state)
         self.logger.info('Cleaning up!')
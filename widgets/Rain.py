@@ -4,9 +4,13 @@
 '''
 import logging
 import requests
+from hashlib import sha1
 from PIL import Image
-from helpers.plot import Plot
 from helpers.textfun import Text
+from helpers.cache import LRUCache
+from helpers.http import HTTP
+from helpers.snapshot import Snapshot
+from helpers.stale import StaleData
 from datetime import date, datetime, timedelta, timezone
 
 logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
@@ -38,20 +42,49 @@ class Rain:
         self.fontSize   = int(cfg.get(self.name, 'fontSize', fallback = 22))
         self.lat        = float(cfg.get(self.name, 'lat', fallback = 51.44))
         self.lon        = float(cfg.get(self.name, 'lon', fallback = 5.47))
-
-        self.timeout = 16
+        self.plotter    = cfg.get(self.name, 'plotter', fallback = 'native')
 
         # Define canvas
         self.canvas = Image.new('L', (self.width, self.height), 0xFF)
 
         # Text manipulation
         self.text = Text(cfg)
-        # Plotting
-        self.plot = Plot(cfg)
+        # Shared HTTP client
+        self.http = HTTP(cfg)
+        # Last good forecast on disk
+        self.snapshot = Snapshot(cfg, self.name)
+        # Forecast in memory, refreshed in the background
+        self.precip = StaleData(cfg, self.name, self._fetch,
+            interval = self.refreshInterval,
+            maxAge = 2 * self.refreshInterval,
+            hardExpiry = 60)
+
+        # Start with the last good forecast from disk, if any
+        data, timestamp = self.snapshot.load()
+        if data != None:
+            self.precip.seed(data, timestamp)
+
+        # Rendered plots by hash of their input, the forecast often
+        # doesn't change between redraws
+        self.plots = LRUCache('{} plots'.format(self.name), budget = 4)
+        # Plot currently on the canvas
+        self.plotKey = None
+        # Plotting, matplotlib is only needed if asked for
+        if self.plotter == 'matplotlib':
+            if cfg.getboolean('main', 'plotWorker', fallback = True):
+                from helpers.plotworker import PlotWorker
+                self.plot = PlotWorker(cfg)
+            else:
+                from helpers.plot import Plot
+                self.plot = Plot(cfg)
+        else:
+            from helpers.rainplot import RainPlot
+            self.plot = RainPlot(cfg)
 
     def _get_precip(self):
         '''
-            Get precipitation a few hours ahead
+            Get precipitation a few hours ahead, and whether it is the
+            same as the previous time
         '''
 
         params = {
@@ -62,35 +95,35 @@ class Rain:
         }
 
         try:
-            r = requests.get(
+            r = self.http.get(
                 self._API_URL,
                 params=params,
-                timeout=self.timeout
+                cache=True
             )
             r.raise_for_status()
         except requests.exceptions.Timeout:
             self.logger.warning("Request timed out")
-            return None
+            return None, False
         except requests.exceptions.HTTPError as e:
             self.logger.warning("HTTP error {}".format(e))
-            return None
+            return None, False
         except requests.exceptions.RequestException as e:
             self.logger.error(e)
-            return None
+            return None, False
 
         try:
             data = r.json()
         except requests.exceptions.JSONDecodeError as e:
             self.logger.error("Invalid JSON: {}".format(e))
-            return None
+            return None, False
 
         if not data.get("success"):
             self.logger.error(
                 "API request failed, reason: {}".format(data.get("reason"))
             )
-            return None
+            return None, False
 
-        return data
+        return data, r.unchanged
 
         # Little test datasets:
 #        #precip = [0, 0.02, 0.11, 0.08, 0.07, 0.06, 0.06, 0.03, 0.01, 0, 0, 0.1, 0.2, 0.4, 1.1, 1.5, 2.0, 5.0, 5.0, 7.0, 3.5, 1.2, 0.45, 0.2]
@@ -100,9 +133,41 @@ class Rain:
 #        start = datetime(2021, 12, 31, 14, 00, 0, 0).timestamp()
 #        delta = 300
 
+    def _fetch(self):
+        '''
+            Get the forecast (see StaleData)
+        '''
+        data, unchanged = self._get_precip()
+
+        if data and not unchanged:
+            self.snapshot.save(data)
+
+        return data, unchanged
+
+    def _plot_key(self, data):
+        '''
+            Hash of everything the plot depends on. A series without any
+            precipitation only depends on its times
+        '''
+        precip = data.get('precip')
+
+        if any(precip):
+            precip = tuple(precip)
+        else:
+            precip = 'dry'
+
+        key = (
+            self.plotter, self.width, self.height, self.margin, self.fontSize,
+            data.get('start'), data.get('delta'), len(data.get('precip')),
+            precip
+        )
+
+        return sha1(repr(key).encode()).hexdigest()
+
     def _plot_precip(self, dt, data):
         '''
-            Call 'plot' helper class to make a nice plot of precipitation.
+            Call 'plot' helper class to make a nice plot of precipitation,
+            returns image of the size of the canvas, None if plotting failed.
             Expected data format:
             {
                 "start": [UTC unix timestamp],
@@ -124,32 +189,93 @@ class Rain:
         # Create epoch for every point
         times = [start + i * delta for i in range(len(precip))]
 
-        self.plot.rain(self.canvas,
-            self.width - 2 * self.margin, 
-            self.height,
-            times, precip,
-            (self.margin, 0),
-            fontsize = self.fontSize,
-            title = 'Precipitation',
-            noRainMsg = 'No rain expected'
-        )
+        img = Image.new('L', (self.width, self.height), 0xFF)
+
+        try:
+            # Only the plot worker tells whether it succeeded
+            drawn = self.plot.rain(img,
+                self.width - 2 * self.margin, 
+                self.height,
+                times, precip,
+                (self.margin, 0),
+                fontsize = self.fontSize,
+                title = 'Precipitation',
+                noRainMsg = 'No rain expected'
+            )
+        except Exception:
+            self.logger.error('Plotting precipitation failed', exc_info = True)
+            return None
 
+        if drawn == False:
+            return None
+
+        return img
 
     def draw(self, **kwargs):
         dt = kwargs.get('datetime')
 
-        data = self._get_precip()
+        data, age = self.precip.get()
 
         if not data:
+            # Expired or never fetched, don't leave an old forecast
+            self.canvas.paste(0xFF, box=(0, 0, self.width, self.height))
+            self.text.textbox(self.canvas,
+                self.precip.noDataText(age),
+                self.width - 2 * self.margin,
+                pos = (self.margin, self.margin),
+                fontsize = self.fontSize,
+                spacing = self.margin)
+            self.plotKey = None
             return self
 
-        # Clear canvas
-        self.canvas.paste(0xFF, box=(0, 0, self.width, self.height))
+        self._draw_data(dt, data)
 
-        self._plot_precip(dt, data)
+        if self.precip.pasteBadge(self.canvas, age):
+            # Paste the plot again next time
+            self.plotKey = None
 
         return self
 
+    def _draw_data(self, dt, data):
+        key = self._plot_key(data)
+        if key == self.plotKey:
+            # Same plot as on the canvas already
+            return
+
+        # Draw plot, or reuse an earlier one with the same input.
+        # A failed plot isn't kept, so it is tried again next time
+        img = self.plots.get(key, lambda: self._plot_precip(dt, data))
+        if img == None:
+            return
+
+        self.canvas.paste(img, box=(0, 0, self.width, self.height))
+        self.plotKey = key
+
+    def drawSnapshot(self, **kwargs):
+        '''
+            Draw the forecast we have (e.g. from disk), without fetching.
+            Returns whether anything was drawn
+        '''
+        data, age = self.precip.get(refresh = False)
+
+        if data == None:
+            return False
+
+        self._draw_data(kwargs.get('datetime'), data)
+
+        # A snapshot is often old, show how old
+        if self.precip.pasteBadge(self.canvas, age):
+            self.plotKey = None
+
+        return True
+
 
     def getCanvas(self):
         return self.canvas
+
+
+    def cleanup(self):
+        # Stop plot worker process, if any
+        if hasattr(self.plot, 'close'):
+            self.plot.close()
+        return
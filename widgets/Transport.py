@@ -4,9 +4,11 @@
 '''
 
 import logging
-from PIL import Image, ImageDraw
+from PIL import Image
 from helpers.textfun import Text
-from helpers.fontawesome import FontAwesome
+from helpers.drawlist import DrawList
+from helpers.snapshot import Snapshot
+from helpers.stale import StaleData
 from datetime import date, datetime, timedelta
 from math import ceil
 
@@ -66,17 +68,31 @@ class Transport:
             'departures': []
         }
 
+        # Departures in memory, refreshed in the background
+        self.departures = StaleData(cfg, self.name, self._fetch,
+            interval = self.fetchInterval,
+            maxAge = 2 * self.fetchInterval,
+            hardExpiry = 120)
+
+        # Start with the last good departures from disk, if any
+        self.snapshot = Snapshot(cfg, self.name)
+        departureInfo, timestamp = self.snapshot.load()
+        if departureInfo != None:
+            self.departures.seed(departureInfo, timestamp)
+
         # Define canvas
         self.canvas = Image.new('L', (self.width, self.height), 0xFF)
 
         # Text manipulation
         self.text = Text(cfg)
-        # Icons
-        self.fa = FontAwesome(cfg)
+        # Text and icons are drawn in one batch
+        self.ops = DrawList(cfg, self.canvas)
         
         self._calculate_geometry()
         
-        self.update_departures()
+        # Start fetching departures, without waiting for them
+        if self.provider:
+            self.departures.refresh()
         
     def _calculate_geometry(self):
         # Calculate sizes and spacings for layout
@@ -138,14 +154,17 @@ class Transport:
             return 'solid/stopwatch'
         return 'solid/stopwatch'
     
-    def update_departures(self):
+    def _fetch(self):
+        '''
+            Get departures from the provider (see StaleData)
+        '''
         response = self.provider.get_departures()
         
         if response['success']:
-            self.departureInfo = response
-            return True
+            self.snapshot.save(response)
+            return response, False
         
-        return False
+        return None, False
     
     def _get_announcement(self, dt):
         depInfo = self.departureInfo
@@ -163,7 +182,7 @@ class Transport:
         return ""
     
     def _draw_message(self, message):
-        self.text.textbox(self.canvas,
+        self.ops.textbox(
                 message,
                 self.width - 2 * self.margin,
                 pos = (self.margin, self.margin),
@@ -172,44 +191,50 @@ class Transport:
                 spacing = self.margin)
     
     def _draw_header(self, dt, stopName, show_dt=True):
-        # Get ImageDraw object
-        draw = ImageDraw.Draw(self.canvas)
-        
         headerString = f"{dt.hour:0>2d}:{dt.minute:0>2d} • " if show_dt else ""
         headerString += stopName
         
         # Draw black box
-        draw.rectangle(
+        self.ops.rectangle(
             [0, 0, self.width, self.headerHeight + self.margin],
             fill = 0x0)
         
+        maxLines = 2 if self.portrait else 1
+
+        # Shrink header text a bit if it doesn't fit, cut it off after that
+        titleSize = self.text.fit(self.canvas,
+            headerString,
+            self.width - 2 * self.margin,
+            font = self.font,
+            max_size = self.titleSize,
+            min_size = self.titleSize * 3 // 4,
+            max_lines = maxLines)
+
         # Write header text
-        self.text.textbox(self.canvas,
+        self.ops.textbox(
             headerString,
             self.width - 2 * self.margin,
             pos = (self.margin, self.margin),
             fill=0xFF,
             font = self.font,
-            fontsize = self.titleSize,
-            max_lines = 2 if self.portrait else 1,
+            fontsize = titleSize,
+            max_lines = maxLines,
             spacing = self.margin)
             # TODO: single line header for portrait as well?
     
     def _draw_footer(self, announcementText):
-        # Get ImageDraw object
-        draw = ImageDraw.Draw(self.canvas)
         vertPos = self.height - self.margin - self.footerHeight
         
         # Draw horizontal line
         if self.lineWidth:
-            draw.line(
+            self.ops.line(
                 [0, vertPos, self.width, vertPos],
                 width = self.lineWidth,
                 fill = self.lineCol)
         
         if announcementText:
             # Show announcements in footer
-            self.text.write(self.canvas,
+            self.ops.write(
                 announcementText,
                 max_width = self.width - 2 * self.margin,
                 pos = (self.margin, vertPos),
@@ -217,25 +242,23 @@ class Transport:
             return True
         else:
             # Show static footer
-            self.text.write(self.canvas,
+            self.ops.write(
                 'Line',
                 pos = (self.margin, vertPos),
                 font = self.font, fontsize = self.fontSize, anchor = 'la')
             
-            self.text.write(self.canvas,
+            self.ops.write(
                 'Destination',
                 pos = (self.margin + self.lineNoWidth + self.padding, vertPos),
                 font = self.font, fontsize = self.fontSize, anchor = 'la')
             
-            self.text.write(self.canvas,
+            self.ops.write(
                 'Time',
                 pos = (self.margin + self.textWidth - self.timeWidth, vertPos),
                 font = self.font, fontsize = self.fontSize, anchor = 'la')
         return False
         
     def _draw_body(self, dt, announcementText, announcementShown):
-        # Get ImageDraw object
-        draw = ImageDraw.Draw(self.canvas)
         # Keep track of vertical position
         vertPos = self.headerHeight + self.margin + self.sparePadding
         
@@ -278,7 +301,7 @@ class Transport:
                 # Draw a horizontal line after every entry
                 if self.lineWidth and i > 0:
                     vp = vertPos - self.padding//2
-                    draw.line(
+                    self.ops.line(
                         [self.margin, vp, self.width-self.margin, vp],
                         width = self.lineWidth,
                         fill = self.lineCol)
@@ -287,24 +310,24 @@ class Transport:
                 if self.departureMins and departureImminent:
                     # Vehicle is departing any moment, show icon instead of time
                     icon = self._get_vehicle_icon(departure['type'])
-                    self.fa.paste_icon(self.canvas,
+                    self.ops.icon(
                         icon, self.fontSize - 2,
                         (self.margin, vertPos + 3)
                     )
                 else:
-                    self.text.write(self.canvas, 
+                    self.ops.write(
                         formattedTime,
                         pos = (self.margin, vertPos),
                         font = self.font, fontsize = self.fontSize, anchor = 'la') 
                 
                 # Write vehicle type and line number
-                self.text.write(self.canvas, 
+                self.ops.write(
                     f"{departure['type']} {departure['lineNumber']}",
                     pos = (self.width - self.margin, vertPos),
                     font = self.font, fontsize = self.fontSize, anchor = 'ra')
                 
                 # Write destination name
-                self.text.write(self.canvas,
+                self.ops.write(
                     departure['name'],
                     max_width = self.width - 2 * self.margin,
                     pos = (self.margin, vertPos + self.fontSize + self.margin),
@@ -313,13 +336,13 @@ class Transport:
                 
             else:
                 # Write line number
-                self.text.write(self.canvas, 
+                self.ops.write(
                     departure['lineNumber'],
                     pos = (self.margin, vertPos),
                     font = self.font, fontsize = self.fontSize, anchor = 'la')
                 
                 # Write destination name
-                self.text.write(self.canvas,
+                self.ops.write(
                     departure['name'],
                     max_width = self.lineNameWidth,
                     pos = (self.margin + self.lineNoWidth + self.padding, vertPos),
@@ -329,12 +352,12 @@ class Transport:
                 if self.departureMins and departureImminent:
                     # Vehicle is departing any moment, show icon instead of time
                     icon = self._get_vehicle_icon(departure['type'])
-                    self.fa.paste_icon(self.canvas,
+                    self.ops.icon(
                         'solid/stopwatch', self.fontSize - 2,
                         (self.margin + self.textWidth - self.timeWidth//2 - self.fontSize//2, vertPos + 3)
                     )
                 else:
-                    self.text.write(self.canvas,
+                    self.ops.write(
                         formattedTime,
                         pos = (self.margin + self.textWidth - self.timeWidth, vertPos),
                         font = self.font, fontsize = self.fontSize, anchor = 'la')
@@ -346,12 +369,12 @@ class Transport:
             # Draw horizontal line
             if self.portrait and self.lineWidth:
                 vp = vertPos - self.padding//2
-                draw.line(
+                self.ops.line(
                     [self.margin, vp, self.width-self.margin, vp],
                     width = self.lineWidth,
                     fill = self.lineCol)
             # Write announcement text
-            self.text.textbox(self.canvas,
+            self.ops.textbox(
                 announcementText,
                 self.width - 2 * self.margin,
                 pos = (self.margin, vertPos),
@@ -361,32 +384,40 @@ class Transport:
                 spacing = self.margin)
 
     def draw(self, **kwargs):
-        # Clear canvas
-        self.canvas.paste(0xFF, box=(0, 0, self.width, self.height))
-
         dt = kwargs.get('datetime')
         
         if not self.provider:
             self._draw_message("No transport provider configured")
+            self.ops.render()
             return self
         
-        if dt.minute % self.fetchInterval == 0:
-            self.update_departures()
-        
-        depInfo = self.departureInfo
-        
-        age_minutes = (dt - depInfo['timestamp']) / timedelta(minutes = 1)
-        
-        if (not depInfo['success']) or age_minutes > 120:
-            msg = "No current data (last successful fetch: "
-            if not depInfo['success']:
-                msg += "never)"
-            elif age_minutes < 1440:
-                msg += f"{int(age_minutes/60)} hours ago)"
-            else:
-                msg += f"{int(age_minutes/1440)} days ago)"
-            self._draw_message(msg)
-            return self
+        depInfo, age = self.departures.get()
+
+        self._draw_departures(dt, depInfo, age)
+
+        return self
+
+    def drawSnapshot(self, **kwargs):
+        '''
+            Draw the departures we have (e.g. from disk), without fetching.
+            Returns whether anything was drawn
+        '''
+        depInfo, age = self.departures.get(refresh = False)
+
+        if not self.provider or depInfo == None:
+            return False
+
+        self._draw_departures(kwargs.get('datetime'), depInfo, age)
+
+        return True
+
+    def _draw_departures(self, dt, depInfo, age):
+        if depInfo == None:
+            self._draw_message(self.departures.noDataText(age))
+            self.ops.render()
+            return
+
+        self.departureInfo = depInfo
 
         announcementText = self._get_announcement(dt)
         announcementShown = False
@@ -404,8 +435,21 @@ class Transport:
         # Draw departures
         self._draw_body(dt, announcementText, announcementShown)
 
-        return self
+        self.departures.drawBadge(self.ops, age, font = self.font)
+
+        self.ops.render()
 
 
     def getCanvas(self):
         return self.canvas
+
+    def icons(self):
+        '''
+            Icons and sizes this widget can draw, to rasterize ahead of time
+        '''
+        if not self.departureMins:
+            return []
+
+        vehicleTypes = ['Bus', 'Tram', 'Metro', 'Veer', None]
+        return [(icon, self.fontSize - 2)
+            for icon in set(map(self._get_vehicle_icon, vehicleTypes))]
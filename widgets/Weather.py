@@ -35,10 +35,13 @@
 import re
 import logging
 import requests
-from PIL import Image, ImageDraw
-from lxml.html import fromstring
+from PIL import Image
 from helpers.textfun import Text
 from helpers.fontawesome import FontAwesome
+from helpers.drawlist import DrawList
+from helpers.http import HTTP
+from helpers.snapshot import Snapshot
+from helpers.stale import StaleData
 from datetime import date, datetime, timedelta
 
 logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
@@ -51,6 +54,23 @@ class Weather:
     _wind_dir = ["N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE", "S", "SSW",
         "SW", "WSW", "W", "WNW", "NW", "NNW"]
 
+    # Classes of the page sections that are parsed, the rest of the page
+    # is thrown away while it is read
+    _sections = ["weather", "forecast-astro", "forecast-hourly",
+        "forecast-fullday"]
+    # Compiled CSS selectors (XPath), by selector
+    _selectors = {}
+
+    _re_icon     = re.compile(r"background-image: url\('.+\/(.+).svg'\)")
+    _re_temp     = re.compile(r"(-?\d+) *°")
+    _re_celsius  = re.compile(r"(-?\d+) *°C")
+    _re_number   = re.compile(r"(\d+[,.]\d+|\d+)")
+    _re_percent  = re.compile(r"(\d+[,.]\d+|\d+)%")
+    _re_pressure = re.compile(r"(\d+[,.]\d+|\d+) hPa")
+    _re_wind     = re.compile(r"([A-Z]+) (\d+)")
+    _re_time     = re.compile(r"(\d{2}:\d{2})")
+    _re_weather_id = re.compile(r"([A-M])(\d{3})([D|N])")
+
     def __init__(self, name, cfg, width, height, pos):
         self.name   = name
         self.logger = logging.getLogger(self.name)
@@ -80,11 +100,11 @@ class Weather:
         self.skipHour   = int(cfg.get(self.name, 'skipHour', fallback = 1))
         self.numDays    = int(cfg.get(self.name, 'days', fallback = 7))
 
-        self.timeout      = 16
-
         # Horizontal and vertical spacing between elements
         self.spacing      = 10
         self.vert_spacing = 20
+        # Vertical spacing between elements within a row
+        self.vert_spacing_mini = 4
 
         self.row_heights = [
             self.height // 5,
@@ -93,18 +113,39 @@ class Weather:
         ]
 
         self.dt = None
+        # Forecast and age badge on the canvas
+        self.drawn = None
+        # Page of the last forecast
+        self.page = None
 
         # Define canvas
         self.canvas = Image.new('L', (self.width, self.height), 0xFF)
 
         # Text manipulation
         self.text = Text(cfg)
+        # Text, icons and lines are drawn in one batch
+        self.ops = DrawList(cfg, self.canvas)
         # Icons
         self.fa = FontAwesome(cfg)
+        # Shared HTTP client
+        self.http = HTTP(cfg)
+        # Last good forecast on disk
+        self.snapshot = Snapshot(cfg, self.name)
+        # Forecast in memory, refreshed in the background
+        self.forecast = StaleData(cfg, self.name, self._fetch,
+            interval = self.refreshInterval,
+            maxAge = 2 * self.refreshInterval,
+            hardExpiry = 360)
+
+        # Start with the last good forecast from disk, if any
+        weather, timestamp = self.snapshot.load()
+        if weather != None:
+            self.forecast.seed(weather, timestamp)
 
     def _get_page(self):
         '''
-            Get content of Weerplaza page
+            Get content of Weerplaza page, and whether it is the same as
+            the previous time
         '''
         url = '{}{}'.format(self._API_URL, self.locationID)
         headers = {
@@ -112,10 +153,10 @@ class Weather:
         }
 
         try:
-            r = requests.get(
+            r = self.http.get(
                 url,
                 headers = headers,
-                timeout = self.timeout
+                cache = True
             )
             r.raise_for_status()
         except requests.exceptions.Timeout:
@@ -125,13 +166,121 @@ class Weather:
         except requests.exceptions.RequestException as e:
             self.logger.error(e)
         else:
-            return r.text
+            return r.text, r.unchanged
+
+        return None, False
+
+    def _fetch(self):
+        '''
+            Get and parse the forecast (see StaleData)
+        '''
+        text, unchanged = self._get_page()
+
+        if not text:
+            return None, False
+
+        if unchanged and self.forecast.data != None:
+            return None, True
+
+        weather = self._parse_page(text)
+
+        if not weather:
+            self._save_failed(text)
+            return None, False
 
-        return None
+        self.page = text
+        self.snapshot.save(weather)
 
-    def _parse_now(self, root):
+        return weather, False
+
+    def _save_failed(self, text):
+        '''
+            Save page that could not be parsed or drawn
+        '''
+        name = 'failed/page{:%Y%m%d-%H%M%S}.html'.format(self.dt)
+        with open(name, 'w') as f:
+            f.write(text)
+
+    @classmethod
+    def _select(cls, element, css):
+        '''
+            Elements below element matching CSS selector, the selector
+            is translated to XPath only once
+        '''
+        if css not in cls._selectors:
+            from lxml.cssselect import CSSSelector
+            cls._selectors[css] = CSSSelector(css, translator = 'html')
+
+        return cls._selectors[css](element)
+
+    def _read_sections(self, text, chunkSize = 16384):
+        '''
+            Read the page in chunks and keep only the (first) sections with
+            the classes in _sections, by class. Everything else is cleared
+            as soon as it has been read
         '''
-            Parse current weather information
+        # lxml is slow to import, only needed once the page is there
+        from lxml import etree, html
+
+        parser = etree.HTMLPullParser(events = ('start', 'end'))
+        parser.set_element_class_lookup(html.HtmlElementClassLookup())
+
+        sections = {}
+        # Section being read, and its class
+        current = None
+        currentName = None
+
+        def classes(element):
+            return element.get('class', '').split()
+
+        def handle(events):
+            nonlocal current, currentName
+
+            for event, element in events:
+                if event == 'start':
+                    if current != None:
+                        continue
+
+                    for name in self._sections:
+                        if name in sections or name not in classes(element):
+                            continue
+                        # Current weather is in a row
+                        if name == 'weather' and not any('row' in classes(a)
+                            for a in element.iterancestors()):
+                            continue
+
+                        current = element
+                        currentName = name
+                        break
+
+                elif element is current:
+                    sections[currentName] = element
+                    parent = element.getparent()
+                    if parent != None:
+                        parent.remove(element)
+                    current = None
+
+                elif current == None:
+                    # Not needed, free it and what came before it
+                    element.clear()
+                    parent = element.getparent()
+                    if parent != None:
+                        while element.getprevious() != None:
+                            del parent[0]
+
+        for i in range(0, len(text), chunkSize):
+            parser.feed(text[i:i + chunkSize])
+            handle(parser.read_events())
+
+        parser.close()
+        handle(parser.read_events())
+
+        return sections
+
+    def _parse_now(self, weather, astro):
+        '''
+            Parse current weather information, from the current weather
+            and astronomical sections
         '''
         now = {
             "id": None,             # 'weather ID' svg name
@@ -153,96 +302,95 @@ class Weather:
             }
         }
 
-        # Get div with current weather
-        div = root.cssselect(".row .weather")
-
-        if not div:
+        # Div with current weather
+        if weather == None:
             return now
 
         # First div: weather icon and temperature
-        id_tmp = div[0].getchildren()[0]
+        id_tmp = weather.getchildren()[0]
 
-        iconStyle = id_tmp.cssselect(".wx")[0].attrib["style"]
-        iconRegex = re.search("background-image: url\('.+\/(.+).svg'\)", iconStyle)
+        iconStyle = self._select(id_tmp, ".wx")[0].attrib["style"]
+        iconRegex = self._re_icon.search(iconStyle)
         if iconRegex:
             now["id"] = iconRegex.group(1)
 
-        tempText = id_tmp.cssselect(".temp")[0].text
-        tempRegex = re.search("(-?\d+) *°", tempText)
+        tempText = self._select(id_tmp, ".temp")[0].text
+        tempRegex = self._re_temp.search(tempText)
         if tempRegex:
             now["temperature"] = int(tempRegex.group(1))
 
         # Second div: summary of other params
-        summary = div[0].getchildren()[1]
+        summary = weather.getchildren()[1]
         params = ['rain', 'wind', 'pressure', 'humidity']
         for param in params:
-            text = summary.cssselect(".{}".format(param))[0].getchildren()[0].text
+            text = self._select(summary, ".{}".format(param))[0].getchildren()[0].text
 
             if param == 'rain':
-                rainRegex = re.search("(\d+[,.]\d+|\d+)", text)
+                rainRegex = self._re_number.search(text)
                 if rainRegex:
                     now["rain"] = float(rainRegex.group(1).replace(',', '.'))
 
             elif param == 'wind':
-                windRegex = re.search("([A-Z]+) (\d+)", text)
+                windRegex = self._re_wind.search(text)
                 if windRegex:
                     now["wind"]["direction"] = self._trns_wind_dir(
                         windRegex.group(1))
                     now["wind"]["speed"] = int(windRegex.group(2))
                 
             elif param == 'pressure':
-                presRegex = re.search("(\d+[,.]\d+|\d+) hPa", text)
+                presRegex = self._re_pressure.search(text)
                 if presRegex:
                     now["pressure"] = float(presRegex.group(1).replace(',', '.'))
                 
             elif param == 'humidity':
-                humRegex = re.search("(\d+[,.]\d+|\d+)%", text)
+                humRegex = self._re_percent.search(text)
                 if humRegex:
                     now["humidity"] = int(humRegex.group(1).replace(',', '.'))
 
-        # Get div with astrological information
-        div = root.cssselect(".forecast-astro")
-        if not div:
+        # Div with astrological information
+        if astro == None:
             return now
 
-        rows = div[0].getchildren()[0].cssselect(".box")[0].cssselect(".row")
-
-        timeRegex = "(\d{2}:\d{2})"
+        box = self._select(astro.getchildren()[0], ".box")[0]
+        rows = self._select(box, ".row")
 
         # Row 0: sun
-        sunrise = rows[0].getchildren()[0].cssselect("span")[0].text_content()
-        sunset  = rows[0].getchildren()[1].cssselect("span")[0].text_content()
+        sunrise = self._select(rows[0].getchildren()[0], "span")[0].text_content()
+        sunset  = self._select(rows[0].getchildren()[1], "span")[0].text_content()
 
         # Row 1: moon
-        moonrise = rows[1].getchildren()[0].cssselect("span")[0].text_content()
-        moonset  = rows[1].getchildren()[1].cssselect("span")[0].text_content()
+        moonrise = self._select(rows[1].getchildren()[0], "span")[0].text_content()
+        moonset  = self._select(rows[1].getchildren()[1], "span")[0].text_content()
 
-        sunrise = re.search(timeRegex, sunrise)
+        sunrise = self._re_time.search(sunrise)
         if sunrise:
             now["sun"]["rise"] = sunrise.group(1)
 
-        sunset = re.search(timeRegex, sunset)
+        sunset = self._re_time.search(sunset)
         if sunset:
             now["sun"]["set"] = sunset.group(1)
 
-        moonrise = re.search(timeRegex, moonrise)
+        moonrise = self._re_time.search(moonrise)
         if moonrise:
             now["moon"]["rise"] = moonrise.group(1)
 
-        moonset = re.search(timeRegex, moonset)
+        moonset = self._re_time.search(moonset)
         if moonset:
             now["moon"]["set"] = moonset.group(1)
 
         return now
 
-    def _parse_48h(self, root):
+    def _parse_48h(self, hourlyDiv):
         '''
-            Parse hourly forecast for the next 48 hours
+            Parse hourly forecast for the next 48 hours, from its section
         '''
         hourly = []
 
         # Get div with 48 hour prediction
-        div = root.cssselect(".forecast-hourly .content section")
+        if hourlyDiv == None:
+            return hourly
+
+        div = self._select(hourlyDiv, ".content section")
         if not div:
             return hourly
 
@@ -278,10 +426,10 @@ class Weather:
             }
 
             # First div: datetimes and weather icon ID
-            summaryDiv = hourDiv.cssselect(".summary-row")[0]
+            summaryDiv = self._select(hourDiv, ".summary-row")[0]
 
             # Weekday and time
-            headDiv = summaryDiv.cssselect(".head")[0]
+            headDiv = self._select(summaryDiv, ".head")[0]
             day     = headDiv.getchildren()[0].text.strip()
             time    = headDiv.getchildren()[1].text.split(":")
             
@@ -307,38 +455,35 @@ class Weather:
             d["time"] = destDay.strftime("%H:%M")
             
             # Weather icon
-            weatherStyle = summaryDiv.cssselect(".wx")[0].attrib["style"]
-            weatherRegex = re.search(
-                "background-image: url\('.+\/(.+).svg'\)",
-                weatherStyle
-            )
+            weatherStyle = self._select(summaryDiv, ".wx")[0].attrib["style"]
+            weatherRegex = self._re_icon.search(weatherStyle)
             if weatherRegex:
                 d["id"] = weatherRegex.group(1)
             
             # Second div: max temperature
-            temperatureDiv = hourDiv.cssselect(".temperature-row")[0]
-            tempText = temperatureDiv.cssselect(".temp")[0].text
-            tempRegex = re.search("(-?\d+) *°C", tempText)
+            temperatureDiv = self._select(hourDiv, ".temperature-row")[0]
+            tempText = self._select(temperatureDiv, ".temp")[0].text
+            tempRegex = self._re_celsius.search(tempText)
 
             if tempRegex:
                 d["temperature"]["max"] = int(tempRegex.group(1))
             
             # Third div: wind chill
-            temperatureGraphDiv = hourDiv.cssselect(".temperature-graph")[0]
-            tooltip = temperatureGraphDiv.cssselect(".tooltip")[0]
-            chillText = tooltip.getchildren()[0].cssselect("span")[0].text
+            temperatureGraphDiv = self._select(hourDiv, ".temperature-graph")[0]
+            tooltip = self._select(temperatureGraphDiv, ".tooltip")[0]
+            chillText = self._select(tooltip.getchildren()[0], "span")[0].text
 
-            tempRegex = re.search("(-?\d+) *°C", chillText)
+            tempRegex = self._re_celsius.search(chillText)
             if tempRegex:
                 d["temperature"]["chill"] = int(tempRegex.group(1))
             
             # Fourth div: precipitation
-            precipDiv = hourDiv.cssselect(".precipitation-row")[0]
+            precipDiv = self._select(hourDiv, ".precipitation-row")[0]
             
             # TODO: Handle snow (given in cm)
             try:
-                rainAmount = precipDiv.cssselect(".precipitation-value")[0].getchildren()[0].text
-                rainRegex = re.search("(\d+[,.]\d+|\d+)", rainAmount)
+                rainAmount = self._select(precipDiv, ".precipitation-value")[0].getchildren()[0].text
+                rainRegex = self._re_number.search(rainAmount)
 
                 if rainRegex:
                     d["rain"]["amount"] = float(
@@ -348,10 +493,10 @@ class Weather:
                 pass
             
             # Sixth div: wind direction and speed
-            windDiv = hourDiv.cssselect(".wind-row")[0]
-            windDescription = windDiv.cssselect(".hide")[0].text
+            windDiv = self._select(hourDiv, ".wind-row")[0]
+            windDescription = self._select(windDiv, ".hide")[0].text
             
-            windRegex = re.search("([A-Z]+) (\d+)", windDescription)
+            windRegex = self._re_wind.search(windDescription)
 
             if windRegex:
                 d["wind"]["direction"] = self._trns_wind_dir(
@@ -362,19 +507,22 @@ class Weather:
 
         return hourly
 
-    def _parse_7d(self, root):
+    def _parse_7d(self, dailyDiv):
         '''
-            Parse daily forecast for the next 7 days
+            Parse daily forecast for the next 7 days, from its section
         '''
 
         daily = []
 
         # Get div with 7 day prediction
-        div = root.cssselect(".forecast-fullday .content")
+        if dailyDiv == None:
+            return daily
+
+        div = self._select(dailyDiv, ".content")
         if not div:
             return daily
 
-        table_7d = div[0].cssselect("table")[0]
+        table_7d = self._select(div[0], "table")[0]
 
         tbody = table_7d.getchildren()[0]
 
@@ -415,13 +563,10 @@ class Weather:
             d["datetime"] = datetime.strptime(ddate, '%d%m%Y').date()
             d["date"] = d["datetime"].strftime("%Y-%m-%d")
 
-            d["rating"] = int(td.cssselect(".weather-rating")[0].text)
+            d["rating"] = int(self._select(td, ".weather-rating")[0].text)
 
-            weatherStyle = td.cssselect(".wx")[0].attrib["style"]
-            weatherRegex = re.search(
-                "background-image: url\('.+\/(.+).svg'\)",
-                weatherStyle
-            )
+            weatherStyle = self._select(td, ".wx")[0].attrib["style"]
+            weatherRegex = self._re_icon.search(weatherStyle)
             if weatherRegex:
                 d["id"] = weatherRegex.group(1)
 
@@ -431,10 +576,7 @@ class Weather:
             td = row[i]
 
             sunChance = td.getchildren()[0].text_content()
-            sunChanceRegex = re.search(
-                "(\d+[,.]\d+|\d+)%",
-                sunChance
-            )
+            sunChanceRegex = self._re_percent.search(sunChance)
             if sunChanceRegex:
                 daily[i]["sun"]["chance"] = int(sunChanceRegex.group(1))
 
@@ -446,16 +588,14 @@ class Weather:
         for i in range(len(daily)):
             td = row[i]
 
-            temp_max = td.cssselect("div.red.temp")[0].text
-            temp_min = td.cssselect("div.blue.temp")[0].text
+            temp_max = self._select(td, "div.red.temp")[0].text
+            temp_min = self._select(td, "div.blue.temp")[0].text
 
-            tempRegex = "(-?\d+) *°C"
-
-            res = re.search(tempRegex, temp_max)
+            res = self._re_celsius.search(temp_max)
             if res:
                 daily[i]["temperature"]["max"] = int(res.group(1))
 
-            res = re.search(tempRegex, temp_min)
+            res = self._re_celsius.search(temp_min)
             if res:
                 daily[i]["temperature"]["min"] = int(res.group(1))
 
@@ -467,11 +607,11 @@ class Weather:
             rainChance = td.getchildren()[0].text_content()
             rainAmount = td.getchildren()[1].text_content()
 
-            chanceRegex = re.search("(\d+[,.]\d+|\d+)%", rainChance)
+            chanceRegex = self._re_percent.search(rainChance)
             if chanceRegex:
                 daily[i]["rain"]["chance"] = int(chanceRegex.group(1))
 
-            rainRegex = re.search("(\d+[,.]\d+|\d+)", rainAmount)
+            rainRegex = self._re_number.search(rainAmount)
             if rainRegex:
                 daily[i]["rain"]["amount"] = float(
                     rainRegex.group(1).replace(',', '.')
@@ -483,7 +623,7 @@ class Weather:
             td = row[i]
 
             windDescription = td.getchildren()[0].text
-            windRegex = re.search("([A-Z]+) (\d+)", windDescription)
+            windRegex = self._re_wind.search(windDescription)
 
             if windRegex:
                 daily[i]["wind"]["direction"] = self._trns_wind_dir(
@@ -496,22 +636,23 @@ class Weather:
         '''
             Parse Weerplaza page
         '''
-        root = fromstring(text)
+        sections = self._read_sections(text)
 
         try:
-            now = self._parse_now(root)
+            now = self._parse_now(sections.get("weather"),
+                sections.get("forecast-astro"))
         except Exception as e:
             self.logger.error("Error parsing current weather", exc_info=True)
             now = None
 
         try:
-            forecast_48h = self._parse_48h(root)
+            forecast_48h = self._parse_48h(sections.get("forecast-hourly"))
         except Exception as e:
             self.logger.error("Error parsing 48h forecast", exc_info=True)
             forecast_48h = None
 
         try:
-            forecast_7d = self._parse_7d(root)
+            forecast_7d = self._parse_7d(sections.get("forecast-fullday"))
         except Exception as e:
             self.logger.error("Error parsing 7d forecast", exc_info=True)
             forecast_7d = None
@@ -526,7 +667,7 @@ class Weather:
 
         return weather if success else None
 
-    def _draw_row1(self, weather, y_pos, height, draw, vert_spacing_mini):
+    def _draw_row1(self, weather, y_pos, height, vert_spacing_mini):
         '''
             First row: current weather ###
         '''
@@ -536,7 +677,7 @@ class Weather:
 
         # Weather icon
         icon = self._icon_to_fontawesome(now['id'])
-        self.fa.paste_icon(self.canvas, icon, size = height - 8,
+        self.ops.icon(icon, size = height - 8,
             pos = (hor_pos + 4, vert_pos + 4)
         )
 
@@ -550,7 +691,7 @@ class Weather:
             fontsize = height
         )
 
-        self.text.write(self.canvas,
+        self.ops.write(
             temp_text,
             pos = (hor_pos, vert_pos + height // 2),
             font = self.font,
@@ -565,20 +706,41 @@ class Weather:
 
         row_height = (height - 2 * vert_spacing_mini) // 3
 
+        labels = [
+            '{} Bft'.format(now["wind"]["speed"]),
+            '{} mm'.format(self._format_rain(now["rain"])),
+            '{} hPa'.format(now["pressure"]),
+            now["sun"]["rise"],
+            now["sun"]["set"]
+        ]
+
+        # Largest text size that fits every minitable column
+        label_width = width_remain // 2 - row_height - self.spacing
+        text_size = min(
+            (self.text.fit(self.canvas,
+                label,
+                label_width,
+                font = self.font,
+                max_size = row_height + 2
+            ) for label in labels if label),
+            default = row_height + 2
+        )
+
         # Minitable row 1/3: wind chill, [wind] wind
         if weather["48h"]:
             chillTemp = weather["48h"][0]["temperature"]["chill"]
             chillText = 'Feels like {}°C'.format(chillTemp)
-            textwidth, _ = self.text.size(self.canvas,
+            text_size = min(text_size, self.text.fit(self.canvas,
                 chillText,
+                width_remain // 2 - self.spacing,
                 font = self.font,
-                fontsize = row_height + 2
-            )
-            self.text.write(self.canvas,
+                max_size = row_height + 2
+            ))
+            self.ops.write(
                 chillText,
                 pos = (hor_pos, vert_pos + row_height // 2),
                 font = self.font,
-                fontsize = row_height + 2,
+                fontsize = text_size,
                 anchor = 'lm'
             )
             hor_pos += width_remain // 2
@@ -589,11 +751,11 @@ class Weather:
             pos = (hor_pos, vert_pos + 2)
         )
         hor_pos += row_height + self.spacing // 2
-        self.text.write(self.canvas,
-            '{} Bft'.format(now["wind"]["speed"]),
+        self.ops.write(
+            labels[0],
             pos = (hor_pos, vert_pos + row_height // 2),
             font = self.font,
-            fontsize = row_height + 2,
+            fontsize = text_size,
             anchor = 'lm'
         )
 
@@ -602,34 +764,33 @@ class Weather:
 
         # Minitable row 2/3: [tint] rain, [tachometer-alt] pressure
 
-        self.fa.paste_icon(self.canvas,
+        self.ops.icon(
             'solid/tint',
             size = row_height - 4,
             pos = (hor_pos, vert_pos + 2)
         )
         hor_pos += row_height + self.spacing // 2
-        text = '{} mm'.format(self._format_rain(now["rain"]))
-        self.text.write(self.canvas,
-            text,
+        self.ops.write(
+            labels[1],
             pos = (hor_pos, vert_pos + row_height // 2),
             font = self.font,
-            fontsize = row_height + 2,
+            fontsize = text_size,
             anchor = 'lm'
         )
 
         hor_pos = table_start + width_remain // 2
 
-        self.fa.paste_icon(self.canvas,
+        self.ops.icon(
             'solid/tachometer-alt',
             size = row_height,
             pos = (hor_pos - 2, vert_pos + 1)
         )
         hor_pos += row_height + self.spacing // 2
-        self.text.write(self.canvas,
-            '{} hPa'.format(now["pressure"]),
+        self.ops.write(
+            labels[2],
             pos = (hor_pos, vert_pos + row_height // 2),
             font = self.font,
-            fontsize = row_height + 2,
+            fontsize = text_size,
             anchor = 'lm'
         )
 
@@ -637,38 +798,38 @@ class Weather:
         vert_pos += row_height + vert_spacing_mini
 
         # Minitable row 3/3: sunrise, sunset
-        self.fa.paste_icon(self.canvas,
+        self.ops.icon(
             'sunrise2',
             size = row_height + 2,
             pos = (hor_pos - 4, vert_pos - 1)
         )
         hor_pos += row_height + self.spacing // 2
-        self.text.write(self.canvas,
-            now["sun"]["rise"],
+        self.ops.write(
+            labels[3],
             pos = (hor_pos, vert_pos + row_height // 2),
             font = self.font,
-            fontsize = row_height + 2,
+            fontsize = text_size,
             anchor = 'lm'
         )
 
         hor_pos = table_start + width_remain // 2
 
-        self.fa.paste_icon(self.canvas,
+        self.ops.icon(
             'sunset2',
             size = row_height + 2,
             pos = (hor_pos - 4, vert_pos + 1)
         )
         hor_pos += row_height + self.spacing // 2
-        self.text.write(self.canvas,
-            now["sun"]["set"],
+        self.ops.write(
+            labels[4],
             pos = (hor_pos, vert_pos + row_height // 2),
             font = self.font,
-            fontsize = row_height + 2,
+            fontsize = text_size,
             anchor = 'lm'
         )
 
 
-    def _draw_row2(self, weather, y_pos, height, draw, vert_spacing_mini):
+    def _draw_row2(self, weather, y_pos, height, vert_spacing_mini):
         '''
             Second row: hourly forecast
         '''
@@ -689,7 +850,7 @@ class Weather:
             yy = vert_pos
 
             # Time
-            self.text.write(self.canvas,
+            self.ops.write(
                 hour["time"],
                 pos = (hor_pos + hour_width // 2, yy),
                 font = self.font,
@@ -700,7 +861,7 @@ class Weather:
 
             # Icon
             icon = self._icon_to_fontawesome(hour["id"])
-            self.fa.paste_icon(self.canvas, 
+            self.ops.icon(
                 icon,
                 size = icon_size,
                 pos = (hor_pos + (hour_width - icon_size) // 2, yy)
@@ -715,7 +876,7 @@ class Weather:
             ]
 
             for item in items:
-                self.text.write(self.canvas,
+                self.ops.write(
                     item,
                     pos = (hor_pos + hour_width // 2, yy),
                     font = self.font,
@@ -735,7 +896,7 @@ class Weather:
                 )
             )
             yy += (element_height - 2) // 2
-            self.text.write(self.canvas,
+            self.ops.write(
                 '{}'.format(hour["wind"]["speed"]),
                 pos = (hor_pos + hour_width // 2 + 2, yy),
                 font = self.font,
@@ -746,13 +907,13 @@ class Weather:
             hor_pos += hour_width
 
             if hour != forecast_48h[-1]: #don't draw line to right
-                draw.line(
+                self.ops.line(
                     [hor_pos, vert_pos, hor_pos, vert_pos + height],
                     width = self.lineWidth,
                     fill = self.lineCol
                 )
 
-    def _draw_row3(self, weather, y_pos, height, draw, vert_spacing_mini):
+    def _draw_row3(self, weather, y_pos, height, vert_spacing_mini):
         '''
             Third row: daily forecast
         '''
@@ -783,7 +944,7 @@ class Weather:
             center_height = vert_pos + day_height // 2
 
             # Name of day, abbreviated (Mon .. Sun)
-            self.text.write(self.canvas,
+            self.ops.write(
                 day["datetime"].strftime('%a'),
                 pos = (xx, center_height),
                 font = self.font,
@@ -794,7 +955,7 @@ class Weather:
 
             # Icon
             icon = self._icon_to_fontawesome(day["id"])
-            self.fa.paste_icon(self.canvas, 
+            self.ops.icon(
                 icon,
                 size = icon_size,
                 pos = (xx, center_height - icon_size // 2)
@@ -802,13 +963,13 @@ class Weather:
             xx += icon_size + 2 * self.spacing
 
             # Temperature
-            self.fa.paste_icon(self.canvas, 
+            self.ops.icon(
                 'solid/thermometer-half',
                 size = smallicon_size,
                 pos = (xx, center_height - smallicon_size // 2)
             )
             
-            self.text.write(self.canvas,
+            self.ops.write(
                 '{}°C to {}°C'.format(
                     day["temperature"]["min"],
                     day["temperature"]["max"]
@@ -822,13 +983,13 @@ class Weather:
             xx += element_width
 
             # Rain
-            self.fa.paste_icon(self.canvas, 
+            self.ops.icon(
                 'solid/tint',
                 size = smallicon_size,
                 pos = (xx, center_height - smallicon_size // 2)
             )
             
-            self.text.write(self.canvas,
+            self.ops.write(
                 '{}%, {} mm'.format(
                     day["rain"]["chance"],
                     self._format_rain(day["rain"]["amount"])
@@ -847,7 +1008,7 @@ class Weather:
                 pos = (xx, center_height - smallicon_size // 2 + 1)
             )
 
-            self.text.write(self.canvas,
+            self.ops.write(
                 '{} Bft'.format(day["wind"]["speed"]),
                 pos = (xx + smallicon_size + 4, center_height),
                 font = self.font,
@@ -859,7 +1020,7 @@ class Weather:
             vert_pos += day_height
 
             if day != forecast_7d[-1]: #don't draw line after last item
-                draw.line([
+                self.ops.line([
                         self.spacing * 2,
                         vert_pos, 
                         self.width - 2 * self.spacing,
@@ -876,34 +1037,45 @@ class Weather:
             Row 2: Hourly forecast
             Row 3: Daily forecast
         '''
-        # Get ImageDraw object
-        draw = ImageDraw.Draw(self.canvas)
-
-        # Vertical spacing between elements
-        vert_spacing_mini = 4
+        vert_spacing_mini = self.vert_spacing_mini
 
         y_pos = 3 * self.margin // 2
-        self._draw_row1(weather, y_pos, self.row_heights[0], draw,
+        self._draw_row1(weather, y_pos, self.row_heights[0],
             vert_spacing_mini)
 
         y_pos += self.row_heights[0] + self.vert_spacing
-        self._draw_row2(weather, y_pos, self.row_heights[1], draw,
+        self._draw_row2(weather, y_pos, self.row_heights[1],
             vert_spacing_mini)
 
         y_pos += self.row_heights[1] + self.vert_spacing
-        self._draw_row3(weather, y_pos, self.row_heights[2], draw,
+        self._draw_row3(weather, y_pos, self.row_heights[2],
             vert_spacing_mini)
 
     def draw(self, **kwargs):
 
         self.dt = kwargs.get('datetime')
 
-        text = self._get_page()
+        weather, age = self.forecast.get()
 
-        if not text:
-            return self        
+        if not weather:
+            # Expired or never fetched, don't leave an old forecast
+            self.ops.textbox(
+                self.forecast.noDataText(age),
+                self.width - 2 * self.margin,
+                pos = (self.margin, self.margin),
+                font = self.font,
+                fontsize = 22,
+                spacing = self.margin)
+            self.ops.render()
+            self.drawn = None
+            return self
 
-        weather = self._parse_page(text)
+        badge = self.forecast.badgeText(age)
+
+        if self.drawn != None and self.drawn[0] is weather \
+            and self.drawn[1] == badge:
+            # Forecast on the canvas is still up to date
+            return self
 
         # import pickle
         # Save data
@@ -914,48 +1086,116 @@ class Weather:
 #        with open('weather.pickle', 'rb') as f:
 #            weather = pickle.load(f)
 
-        fail = False
+        try:
+            self._draw_forecast(weather)
+        except:
+            self.logger.error("Error drawing forecast", exc_info=True)
+            self.ops.clear()
+            self.drawn = None
 
-        if weather:
-            # Clear canvas
-            self.canvas.paste(0xFF, box=(0, 0, self.width, self.height))
+            # Save failed responses
+            if self.page:
+                self._save_failed(self.page)
+        else:
+            self.forecast.drawBadge(self.ops, age, font = self.font)
+            self.ops.render()
+            self.drawn = (weather, badge)
 
-            try:
-                self._draw_forecast(weather)
-            except:
-                self.logger.error("Error drawing forecast", exc_info=True)
-                fail = True
+        return self
 
-        else:
-            fail = True
 
-        if fail:
-            # Save failed responses
-            name = 'failed/page{:%Y%m%d-%H%M%S}.html'.format(self.dt)
-            with open(name, 'w') as f:
-                f.write(text)
+    def drawSnapshot(self, **kwargs):
+        '''
+            Draw the forecast we have (e.g. from disk), without fetching.
+            Returns whether anything was drawn
+        '''
+        weather, age = self.forecast.get(refresh = False)
 
-        return self
+        if weather == None:
+            return False
+
+        self.dt = kwargs.get('datetime')
+
+        try:
+            self._draw_forecast(weather)
+        except:
+            self.logger.error("Error drawing saved forecast", exc_info=True)
+            self.ops.clear()
+            return False
 
+        # A snapshot is often old, show how old
+        self.forecast.drawBadge(self.ops, age, font = self.font)
+        self.ops.render()
+        self.drawn = (weather, self.forecast.badgeText(age))
+
+        return True
 
     def getCanvas(self):
         return self.canvas
 
+    def rotatedIcons(self):
+        '''
+            Wind direction arrows in every direction, rotated ahead of time
+            once the arrow itself is rasterized
+        '''
+        return [(icon, size, self._windvane_angle(direction))
+            for icon, size in self.icons() if icon == 'arrow'
+            for direction in self._wind_dir]
+
+    def icons(self):
+        '''
+            Icons and sizes this widget can draw, to rasterize ahead of time.
+            Sizes follow those in `_draw_row1` .. `_draw_row3`.
+        '''
+        vert_spacing_mini = self.vert_spacing_mini
+        weather_icons = self._weather_icons()
+
+        # First row: current weather
+        height = self.row_heights[0]
+        row_height = (height - 2 * vert_spacing_mini) // 3
+
+        icons = [(icon, height - 8) for icon in weather_icons]
+        icons += [
+            ('arrow', row_height - 4),
+            ('solid/tint', row_height - 4),
+            ('solid/tachometer-alt', row_height),
+            ('sunrise2', row_height + 2),
+            ('sunset2', row_height + 2)
+        ]
+
+        # Second row: hourly forecast
+        height = self.row_heights[1]
+        icon_size = height // 4 - 4
+        element_height = (height - (vert_spacing_mini * 4 + icon_size)) // 4
+
+        icons += [(icon, icon_size) for icon in weather_icons]
+        icons += [('arrow', element_height - 2)]
+
+        # Third row: daily forecast
+        day_height = self.row_heights[2] // self.numDays
+        icon_size = day_height - 2 * vert_spacing_mini - 2
+        smallicon_size = icon_size - 4
+
+        icons += [(icon, icon_size) for icon in weather_icons]
+        icons += [
+            ('arrow', smallicon_size - 2),
+            ('solid/tint', smallicon_size),
+            ('solid/thermometer-half', smallicon_size)
+        ]
+
+        return icons
+
     def _draw_windvane(self, direction, size, pos = (0,0)):
 
-        icon = self.fa.get_icon('arrow', size=size)
-        angle = self._direction_to_angle(direction) - 180
+        angle = self._windvane_angle(direction)
 
-        if icon:
-            icon = icon.rotate(
-                angle = -angle, # argument is counter-clockwise
-                fillcolor = 255
-            )
-            box = (
-                pos[0], pos[1],
-                pos[0] + size, pos[1] + size
-            )
-            self.canvas.paste(icon, box)
+        self.ops.icon('arrow', size, pos, angle = angle)
+
+    def _windvane_angle(self, direction):
+        '''
+            Arrow points where the wind blows to, opposite of its direction
+        '''
+        return self._direction_to_angle(direction) - 180
 
     def _direction_to_angle(self, direction):
         '''
@@ -993,12 +1233,24 @@ class Weather:
         '''
         return direction.replace('Z', 'S').replace('O', 'E')
 
+    @classmethod
+    def _weather_icons(cls):
+        '''
+            All FontAwesome icons that weather IDs can translate to
+        '''
+        return sorted(set(
+            cls._icon_to_fontawesome('{}{:03d}{}'.format(letter, num, dayNight))
+            for letter in 'ABCDEFGHIJKLM'
+            for num in range(10)
+            for dayNight in 'DN'
+        ))
+
     @staticmethod
     def _icon_to_fontawesome(weatherID):
         '''
             Translate Weerplaza 'weather ID' svg name to FontAwesome icon name
         '''
-        parse = re.search("([A-M])(\d{3})([D|N])", weatherID)
+        parse = Weather._re_weather_id.search(weatherID)
         if not parse:
             return 'regular/question-circle'
 
@@ -7,16 +7,31 @@
         - google-auth-oauthlib
     AND token.json file, obtain using example on
     https://developers.google.com/calendar/api/quickstart/python
+
+    The Google packages take long to import, so that is done on first use
+    (in the widget's drawing thread) instead of at startup
+
+    Credentials and the API client are kept in memory. Events are
+    synchronised incrementally (with a sync token), so a refresh only
+    transfers events that changed since the previous one. They are kept
+    in an index by day (helpers/eventindex.py), which is saved with the
+    sync tokens in 'snapshotDir' to continue from after a restart.
+    Recurring events come as separate instances without end, so only the
+    events up to 'googleHorizon' days ahead are kept. Once the days shown
+    get past that, the calendar is synchronised in full again.
+    Calendars are fetched in parallel, a calendar that fails or doesn't
+    respond within 'googleTimeout' seconds is left out
 '''
 import os.path
+import time
 import socket
 import logging
-from dateutil.parser import isoparse
+import threading
+from multiprocessing.pool import ThreadPool, TimeoutError
 from datetime import date, datetime, timedelta, timezone
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from helpers.eventindex import EventIndex
+from helpers import isotime
+from helpers.snapshot import Snapshot
 
 logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
 logging.getLogger('googleapiclient.discovery').setLevel(logging.WARNING)
@@ -42,11 +57,45 @@ class Google:
             if calendar:
                 self.calendars.append(calendar)
 
+        # Kept between refreshes
         self.creds = None
+        self.service = None
+        # Token for the next sync per calendar, and the synced events,
+        # kept on disk between runs
+        self.tokens = {}
+        # Last day with events in the index per calendar, set on full sync
+        self.until = {}
+        self.index = EventIndex()
+        self.store = Snapshot(cfg, 'google-calendar')
+
+        stored, timestamp = self.store.load()
+        if stored != None:
+            self.tokens = {calendarId: token
+                for calendarId, token in stored['tokens'].items()
+                if calendarId in self.calendars}
+            self.until = stored.get('until', {})
+            self.index = stored['index']
+            # Calendars no longer in the config file
+            for id in self.index.ids():
+                if id[0] not in self.tokens:
+                    self.index.remove(id)
+
+        # Seconds to wait for the calendars
+        self.timeout = float(cfg.get(wName, 'googleTimeout', fallback = timeout))
+        # Days ahead to keep events for
+        self.horizon = timedelta(days = int(cfg.get(wName, 'googleHorizon',
+            fallback = 60)))
+        # Calendars are fetched in parallel, every thread has its own
+        # connection as those can't be shared between threads
+        self.pool = None
+        self.local = threading.local()
 
 
     def _refresh_credentials(self):
-        if os.path.exists('token.json'):
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+
+        if self.creds == None and os.path.exists('token.json'):
             self.creds = Credentials.from_authorized_user_file('token.json', SCOPES)
 
         if not self.creds or not self.creds.valid:
@@ -60,6 +109,8 @@ class Google:
                     return False
             else:
                 self.logger.error("Need a new token, can't do that here!")
+                # Read token.json again next time
+                self.creds = None
                 return False
 
             try:
@@ -72,112 +123,241 @@ class Google:
 
         return True
 
-    def _get_events(self, timeMin, timeMax, maxResults = 50):
-        all_events = []
-        clean_events = []
+    def _get_service(self):
+        from googleapiclient.discovery import build
+
+        if self.service == None:
+            self.service = build('calendar', 'v3', credentials=self.creds,
+                cache_discovery=False)
+
+        return self.service
+
+    def _get_http(self):
+        '''
+            Authorised connection for the current thread
+        '''
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+
+        http = getattr(self.local, 'http', None)
+        if http == None or http.credentials is not self.creds:
+            http = AuthorizedHttp(self.creds,
+                http = httplib2.Http(timeout = self.timeout))
+            self.local.http = http
+
+        return http
+
+    @staticmethod
+    def _event_times(event):
+        '''
+            Start and end of event in system timezone, and whether
+            it is an all-day event
+        '''
+        start = event['start'].get('dateTime', [])
+        if start:
+            allDay = False
+        else:
+            allDay = True
+            start = event['start'].get('date')
+
+        end = event['end'].get('dateTime', event['end'].get('date'))
+
+        # Convert datetimes to system timezone
+        return isotime.local(start), isotime.local(end), allDay
+
+    def _sync(self, service, calendarId, timeMin, lastDay):
+        '''
+            Get the events of a calendar that changed since the last sync,
+            the first time (or when the index doesn't reach lastDay) all
+            events from timeMin on.
+            Returns changed events, the token for the next sync and
+            whether this was a full sync
+        '''
+        from googleapiclient.errors import HttpError
+
+        token = self.tokens.get(calendarId)
+        if lastDay > self.until.get(calendarId, date.min):
+            # Events after the horizon of the last full sync are missing
+            token = None
+
+        params = {
+            'calendarId': calendarId,
+            'singleEvents': True,
+            'maxResults': 250
+        }
+        if token:
+            params['syncToken'] = token
+        else:
+            params['timeMin'] = timeMin.isoformat()
+
+        events = []
+        pageToken = None
+        while True:
+            try:
+                result = service.events().list(
+                    pageToken = pageToken, **params).execute(
+                    http = self._get_http())
+            except HttpError as e:
+                if token and e.resp.status == 410:
+                    # Sync token no longer valid, start over
+                    self.logger.debug('Full sync of calendar {}'.format(
+                        calendarId))
+                    self.tokens.pop(calendarId, None)
+                    return self._sync(service, calendarId, timeMin, lastDay)
+                raise
+
+            events += result.get('items', [])
+
+            pageToken = result.get('nextPageToken')
+            if not pageToken:
+                break
+
+        return events, result.get('nextSyncToken'), not token
+
+    def _expand(self, event):
+        '''
+            Calendar items of an event for every (local) day it covers,
+            as entries for the event index
+        '''
+        startLocal, endLocal, allDay = self._event_times(event)
+
+        # Format time as hh:mm or None
+        if allDay:
+            fmtTime = None
+        else:
+            fmtTime = startLocal.strftime('%H:%M')
+
+        duration = (endLocal.date() - startLocal.date()).days
+
+        # Fix duration if event ends at midnight
+        if duration > 0 and endLocal.hour == 0 and endLocal.minute == 0:
+            duration -= 1
+
+        entries = []
+        for i in range(duration + 1):
+            start = startLocal + timedelta(days = i)
+            if i == 0:
+                item = {
+                    'start': start,
+                    'time': fmtTime,
+                    'all_day': allDay,
+                    'summary': event['summary']
+                }
+            else:
+                # Rest of a multi-day event
+                item = {
+                    'start': start,
+                    'time': None,
+                    'all_day': True,
+                    'summary': event['summary']
+                }
+            entries.append((start.date(), start, endLocal, item))
+
+        return entries
+
+    def _apply(self, calendarId, events, full):
+        '''
+            Put synced events of a calendar in the index, up to the
+            calendar's horizon
+        '''
+        if full:
+            for id in self.index.ids():
+                if id[0] == calendarId:
+                    self.index.remove(id)
+
+        until = self.until[calendarId]
+
+        for event in events:
+            id = (calendarId, event['id'])
+            if event.get('status') == 'cancelled':
+                self.index.remove(id)
+                continue
+
+            entries = [entry for entry in self._expand(event)
+                if entry[0] <= until]
+            if entries:
+                self.index.put(id, entries)
+            else:
+                self.index.remove(id)
 
-        localTime = timeMin.astimezone()
+    def _get_events(self, timeMin, firstDay, lastDay):
+        '''
+            Bring the index up to date with all calendars, and return the
+            items by date of events ending after timeMin. None if none of
+            the calendars could be fetched
+        '''
+        service = self._get_service()
 
-        with build('calendar', 'v3', credentials=self.creds, cache_discovery=False) as service:
+        if self.pool == None:
+            self.pool = ThreadPool(max(1, min(4, len(self.calendars))))
 
-            for calendarId in self.calendars:
-                request = service.events().list(
-                    calendarId = calendarId,
-                    timeMin = timeMin.isoformat(),
-                    timeMax = timeMax.isoformat(),
-                    maxResults = maxResults,
-                    singleEvents = True,
-                    orderBy = 'startTime'
-                )
+        results = [(calendarId, self.pool.apply_async(self._sync,
+            (service, calendarId, timeMin, lastDay)))
+            for calendarId in self.calendars]
 
-                try:
-                    events_result = request.execute()
-                except Exception as e:
-                    self.logger.error('Error getting events from calendar {}:'.format(calendarName))
-                    self.logger.error(e)
-                else:
-                    events = events_result.get('items', [])
-                    all_events += events
+        deadline = time.time() + self.timeout
+        success = False
+        changed = False
 
-        # Extract and transform relevant event info
-        for event in all_events:
+        for calendarId, result in results:
+            try:
+                events, token, full = result.get(max(0, deadline - time.time()))
+            except TimeoutError:
+                self.logger.error('Calendar {} did not respond in time'.format(calendarId))
+                continue
+            except Exception as e:
+                self.logger.error('Error getting events from calendar {}:'.format(calendarId))
+                self.logger.error(e)
+                continue
 
-            start = event['start'].get('dateTime', [])
-            if start:
-                allDay = False
-            else:
-                allDay = True
-                start = event['start'].get('date')
+            success = True
 
-            end = event['end'].get('dateTime', event['end'].get('date'))
+            if full:
+                self.until[calendarId] = firstDay + self.horizon
 
-            # Convert datetimes to system timezone
-            startLocal = isoparse(start).astimezone()
-            endLocal = isoparse(end).astimezone()
+            if events or full:
+                self._apply(calendarId, events, full)
+                changed = True
 
-            # Format time as hh:mm or None
-            if allDay:
-                fmtTime = None
-            else:
-                fmtTime = startLocal.strftime('%H:%M')
+            # Only after the events are in the index, so a sync that
+            # timed out is done again
+            if token != self.tokens.get(calendarId):
+                self.tokens[calendarId] = token
+                changed = True
 
-            # Calculate how many days ahead the event is
-            diff = (startLocal.date() - timeMin.astimezone().date()).days
+        if self.calendars and not success:
+            # Nothing at all, better show what we had
+            return None
 
-            # Calculate duration of event
-            if diff >= 0:
-                duration = (endLocal.date() - startLocal.date()).days
-            else:
-                duration = (endLocal.date() - localTime.date()).days
-
-            # Fix duration if event ends at midnight
-            if duration > 0 and endLocal.hour == 0 and endLocal.minute == 0:
-                duration -= 1
-
-            # Put past multi-day events on day zero
-            startDate = startLocal if diff >= 0 else localTime
-            startTime = fmtTime if diff >= 0 else None
-            start_days_ahead = diff if diff >= 0 else 0
-
-            for i in range(duration + 1):
-                if i == 0:
-                    fmt_event = {
-                        'start': startDate,
-                        'time': startTime,
-                        'days_ahead': start_days_ahead,
-                        'all_day': allDay if diff >= 0 else True,
-                        'summary': event['summary']
-                    }
-                else:
-                    fmt_event = {
-                        'start': startDate + timedelta(days = i),
-                        'time': None,
-                        'days_ahead': start_days_ahead + i,
-                        'all_day': True,
-                        'summary': event['summary']
-                    }
-                clean_events.append(fmt_event)
-
-
-        # Sort events by date
-        clean_events = sorted(
-            clean_events,
-            key=lambda event: event['start']
-        )
-
-        return clean_events
+        self.index.prune(firstDay)
+
+        if changed:
+            self.logger.debug('{} events in index'.format(len(self.index)))
+            self.store.save({'tokens': self.tokens, 'until': self.until,
+                'index': self.index})
+
+        return self.index.range(firstDay, lastDay, timeMin)
 
 
     def get_calendar_items(self, dt, days_ahead):
+        '''
+            Calendar items per day (see _calendar_demo.py), or None if
+            they could not be fetched
+        '''
 
         if not self._refresh_credentials():
-            return []
+            return None
 
-        # Get start and end times in UTC
+        # Get start time in UTC
         utc_time = dt.astimezone(timezone.utc) #datetime.now(tz=timezone.utc)
 
-        time_ahead = dt + timedelta(days = days_ahead)
-        time_ahead = time_ahead.replace(hour=23, minute=59, second=59, microsecond=0)
-        utc_time_ahead = time_ahead.astimezone(timezone.utc)
+        today = dt.astimezone().date()
+
+        days = self._get_events(utc_time, today,
+            today + timedelta(days = days_ahead))
+
+        if days == None:
+            return None
 
-        return self._get_events(utc_time, utc_time_ahead)
+        return {(day - today).days: items_day
+            for day, items_day in days.items()}
@@ -3,11 +3,14 @@
 
     Needs 'apiKey' client API key in config.ini, obtained following https://www.vertrektijd.info/starten.html
 '''
+import time
 import logging
 from datetime import date, datetime, timedelta
-from dateutil.parser import isoparse
 import requests
 from urllib.parse import quote
+from helpers.http import HTTP
+from helpers.snapshot import Snapshot
+from helpers import isotime
 
 wName = 'Transport'
 
@@ -38,11 +41,19 @@ class VertrektijdInfo:
         self.api_key = cfg.get(wName, 'apiKey', fallback = "")
         
         self.stopName = cfg.get(wName, 'stopName', fallback = "")
-        self.stopCodes = cfg.get(wName, 'stopCodes', fallback = "")
+        self.configCodes = cfg.get(wName, 'stopCodes', fallback = "")
+        # Stop codes from config file and those found for stopName
+        self.stopCodes = self.configCodes
+        self.stopNameResolved = False
+        
+        # Stop codes found for stop names are kept on disk (days)
+        self.stopCodesTTL = 86400 * float(cfg.get(wName, 'stopCodesTTL',
+            fallback = 30))
+        self.resolved = Snapshot(cfg, 'vertrektijd-stopcodes')
         
         self.lastStopName = ""
         
-        self.timeout = 10
+        self.http = HTTP(cfg)
         
         # Default GET header for requests
         self.headers = {
@@ -53,13 +64,31 @@ class VertrektijdInfo:
         
         self.logger.debug(f"stopCodes from config: {self.stopCodes}")
         
-        if self.stopName:
-            self._get_stopcodes()
+        # Finding stop codes needs the API, so that is left to the first
+        # fetch of departures if they are not on disk
+        if self.stopName and self._load_stopcodes():
             self.logger.debug(f"stopCodes total: {self.stopCodes}")
         
-        if not self.stopCodes:
+        if not self.stopCodes and not self.stopName:
             self.logger.error(f"No stopCodes or valid stopName configured!")
     
+    def _set_stopcodes(self, codes):
+        self.stopCodes = ",".join(x for x in [self.configCodes, codes] if x)
+        self.stopNameResolved = True
+    
+    def _load_stopcodes(self):
+        '''
+            Stop codes found earlier for stopName
+        '''
+        stored, _ = self.resolved.load()
+        entry = (stored or {}).get(self.stopName)
+        
+        if entry == None or time.time() - entry['timestamp'] > self.stopCodesTTL:
+            return False
+        
+        self._set_stopcodes(entry['stopCodes'])
+        return True
+    
     def _get_stopcodes(self):
         town, stop = [x.strip() for x in self.stopName.split(',', 1)]
         result = self._get_departures_nametown(town, stop)
@@ -68,57 +97,34 @@ class VertrektijdInfo:
             self.logger.error(f"Unable to get departures for stop {stop} in {town}")
             return
         
-        for station in result['TRAIN']:
-            info = station['Station_Info']
-            self.logger.debug(f"** Train station {info['StopName']} in {info['Town']} **")
-            self.logger.debug(f"StopCode: {info['StopCode']}")
-            self.logger.debug(f"Departures:")
-            
-            for departure in station['Departures']:
-                self.logger.debug(
-                    f"* {departure['PlannedDeparture']} +{departure['Delay']} min "
-                    f"[Platform {departure['Platform']}] "
-                    f"{departure['TransportTypeCode']} to {departure['Destination']}"
-                )
-                for tip in departure['Tips']:
-                    self.logger.debug(f"Tip: {tip}")
-                
-                for comment in departure['Comments']:
-                    self.logger.debug(f"Comment: {comment}")
-            
+        codes = []
         for stop in result['BTMF']:
             info = stop['Station_Info']
-            self.logger.debug(f"** BTMF stop {info['StopName']} in {info['Town']} **")
-            self.logger.debug(f"StopCode: {info['StopCode']}")
-            
-            self.stopCodes += ("," if self.stopCodes else "") + info['StopCode']
-            
-            if 'Station_Messages' in stop:
-                msg = stop['Station_Messages']
-                self.logger.debug(
-                    "Message (valid "
-                    f"{msg['MessageStartTime']} to {msg['MessageEndTime']}):"
-                )
-                self.logger.debug(
-                    f"{msg['MessageTimeStamp']} [{msg['AgencyCode']}]: "
-                    f"{msg['MessageContent']}"
-                )
-            
-            self.logger.debug(f"Departures:")
-            for departure in stop['Departures']:
-                if 'Destination' in departure: # weird bugfix for some future Metros
-                    self.logger.debug(
-                        f"* {departure['PlannedDeparture']} → {departure['ExpectedDeparture']} "
-                        f"{departure['AgencyCode']} {departure['TransportType']} "
-                        f"{departure['LineNumber']} to {departure['Destination']} "
-                        f"({departure['VehicleStatus']})"
-                    )
+            self.logger.debug(f"BTMF stop {info['StopName']} in {info['Town']}: "
+                f"StopCode {info['StopCode']}")
+            codes.append(info['StopCode'])
+        
+        if not codes:
+            # Don't keep this, try again on the next fetch
+            self.logger.warning(f"No BTMF stops found for {self.stopName}")
+            return
+        
+        codes = ",".join(codes)
+        self._set_stopcodes(codes)
+        self.logger.debug(f"stopCodes total: {self.stopCodes}")
+        
+        stored, _ = self.resolved.load()
+        stored = stored or {}
+        stored[self.stopName] = {
+            'stopCodes': codes,
+            'timestamp': time.time()
+        }
+        self.resolved.save(stored)
     
     def _parse_timestamp(self, time_string):
-        # Parse ISO 8601 and convert to datetime object in current timezone
-        dt = isoparse(time_string).astimezone()
-        # Remove timezone attribute to make it offset-naive
-        return dt.replace(tzinfo=None)
+        # Parse ISO 8601 and convert to offset-naive datetime object
+        # in current timezone
+        return isotime.local(time_string, naive = True)
     
     def _format_timestamp(self, dt):
         return f"{dt.hour:0>2d}:{dt.minute:0>2d}"
@@ -132,11 +138,9 @@ class VertrektijdInfo:
             'announcements': []
         }
         
-        if not self.stopCodes:
-            # Retry getting stopCodes from stopName
-            self.logger.warning(f"No stopCodes! Retrying..")
+        if self.stopName and not self.stopNameResolved:
+            # Get stopCodes from stopName
             self._get_stopcodes()
-            self.logger.warning(f"Got stopCodes: {self.stopCodes}")
         
         if not self.stopCodes:
             return response
@@ -216,11 +220,10 @@ class VertrektijdInfo:
 
     def _request_json(self, url_relative):
         try:
-            r = requests.get(
+            r = self.http.get(
                 self._API_BASE_URL + 
                     quote(url_relative),
-                headers = self.headers,
-                timeout = self.timeout
+                headers = self.headers
             )
             r.raise_for_status()
         except requests.exceptions.Timeout: